@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Offline benchmark: generate seeded puzzles, solve, verify, measure and compare
+
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tracemalloc
+
+import npuzzle
+
+generator = npuzzle.load_script('npuzzle_gen', 'npuzzle-gen.py')
+verifier = npuzzle.load_script('npuzzle_verify', 'npuzzle-verify.py')
+
+def make_puzzle_text(size: int, seed: int, iterations: int) -> tuple[list[int], str]:
+    """Return a solvable seeded puzzle as flat tiles and in the input format.
+    Uses uniformly random puzzles if :iterations is 0.
+    """
+    random.seed(seed)
+    if iterations:
+        tiles = generator.make_puzzle(size, solvable=True, iterations=iterations)
+    else:
+        tiles = generator.make_random_puzzle(size, solvable=True)
+    rows = (' '.join(map(str, tiles[row * size:(row + 1) * size])) for row in range(size))
+    return tiles, f'{size}\n' + '\n'.join(rows) + '\n'
+
+def solve(text: str, optimize: bool) -> tuple[npuzzle.Puzzle, float]:
+    """Parse and solve :text, return the puzzle and the solve time.
+    """
+    puzzle = npuzzle.Puzzle(io.StringIO(text), optimize=optimize)
+    start = time.perf_counter()
+    puzzle.solve()
+    return puzzle, time.perf_counter() - start
+
+def verify(tiles: list[int], size: int, moves: npuzzle.MoveBuffer) -> bool:
+    """Check :moves with the verifier, return False on an illegal move.
+    """
+    rows = [tiles[row * size:(row + 1) * size] for row in range(size)]
+    try:
+        return verifier.verify_puzzle(rows, (chunk.decode() for chunk in moves.chunks()), jobs=1)
+    except verifier.VerifyError:
+        return False
+
+def measure_peak_memory(text: str, optimize: bool) -> int:
+    """Return the peak of memory allocated while parsing and solving :text.
+    Runs separately from the timed runs, as tracing slows everything down.
+    """
+    tracemalloc.start()
+    try:
+        solve(text, optimize)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def run_benchmark(sizes: list[int], repeat: int, seed: int, iterations: int, optimize: bool, memory: bool) -> list[dict]:
+    results = []
+    for size in sizes:
+        tiles, text = make_puzzle_text(size, seed + size, iterations)
+        times = []
+        verified = True
+        for _ in range(repeat):
+            puzzle, elapsed_seconds = solve(text, optimize)
+            times.append(elapsed_seconds)
+            verified = verified and verify(tiles, size, puzzle.moves)
+        n_moves = len(puzzle.moves)
+        result = {
+            'size': size,
+            'seed': seed + size,
+            'times': times,
+            'best': min(times),
+            'median': statistics.median(times),
+            'moves': n_moves,
+            'moves_per_second': n_moves / statistics.median(times) if n_moves else 0.0,
+            'peak_memory': measure_peak_memory(text, optimize) if memory else None,
+            'verified': verified,
+        }
+        results.append(result)
+        peak = f'{result["peak_memory"] / 1e6:.3f} MB' if memory else '-'
+        print(f'Size: {size}, Time: {result["median"]:.6f}s, Moves: {n_moves}, '
+              f'Moves/s: {result["moves_per_second"]:.0f}, Memory Peak: {peak}, '
+              f'{"OK" if verified else "KO"}', file=sys.stderr, flush=True)
+    return results
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[str]:
+    """Return a message for every size whose median time, peak memory or move
+    count got worse than :baseline by more than :threshold (relative), and for
+    every failed verification.
+    """
+    regressions = []
+    baseline_by_size = {result['size']: result for result in baseline}
+    for result in results:
+        if not result['verified']:
+            regressions.append(f'Size {result["size"]}: verification failed')
+        old = baseline_by_size.get(result['size'])
+        if old is None:
+            continue
+        for key in ('median', 'peak_memory', 'moves'):
+            if result[key] is None or old[key] is None or not old[key]:
+                continue
+            change = result[key] / old[key] - 1
+            if change > threshold:
+                regressions.append(f'Size {result["size"]}: {key} {old[key]:.6g} -> {result[key]:.6g} (+{change * 100:.1f}%)')
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', default=[10, 50, 100], help='Puzzle sizes to benchmark')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Timed solves per size')
+    parser.add_argument('-s', '--seed', type=int, default=42, help='Base seed of the generated puzzles')
+    parser.add_argument('-i', '--iterations', type=int, default=10000, help='Generator passes, 0 for uniformly random puzzles')
+    parser.add_argument('-O', '--optimize', action='store_true', default=False, help='Solve with npuzzle.py --optimize')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', default=True, help='Skip the (slow) peak memory measurement')
+    parser.add_argument('-o', '--output', metavar='FILE', help='Write the results as JSON to FILE')
+    parser.add_argument('-c', '--compare', metavar='FILE', help='Compare against a baseline JSON written by --output')
+    parser.add_argument('-t', '--threshold', type=float, default=0.1, help='Relative change counted as a regression (default: 0.1)')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.repeat, args.seed, args.iterations, args.optimize, args.memory)
+    report = {
+        'python': platform.python_implementation() + ' ' + platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': args.repeat,
+        'iterations': args.iterations,
+        'optimize': args.optimize,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+
+    exit_code = 0 if all(result['verified'] for result in results) else 1
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file)['results'], args.threshold)
+        for regression in regressions:
+            print(f'\033\x5b31mRegression: {regression}\033\x5bm', file=sys.stderr)
+        if regressions:
+            exit_code = 1
+    raise SystemExit(exit_code)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# Drop-in for `npuzzle.py < file` that lets a running npuzzle-server.py solve
+
+import os
+import sys
+import json
+import socket
+import argparse
+import tempfile
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'npuzzle.sock') # see npuzzle-server.py
+STATS_REQUEST = b'STATS\n'
+BUFFER_SIZE = 1 << 16
+
+def connect(socket_path: str, host: str, port: int | None) -> socket.socket:
+    if port is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        return sock
+    return socket.create_connection((host, port))
+
+def request(sock: socket.socket, data: bytes) -> int:
+    """Send :data to the server, copy the streamed moves to standard output and
+    the stats line to standard error, and return the exit code npuzzle.py would
+    have returned.
+    """
+    sock.sendall(data)
+    sock.shutdown(socket.SHUT_WR)
+    stdout = sys.stdout.buffer
+    trailer = bytearray()
+    in_moves = True
+    while part := sock.recv(BUFFER_SIZE):
+        if in_moves:
+            end = part.find(b'\n')
+            if end == -1:
+                stdout.write(part)
+                continue
+            in_moves = False
+            trailer += part[end + 1:]
+            stdout.write(part[:end])
+            continue
+        trailer += part
+    if in_moves:
+        print('\033\x5b31mConnection closed by server\033\x5bm', file=sys.stderr, flush=True)
+        return 1
+    result = json.loads(trailer)
+    sys.stderr.write(result['report'])
+    sys.stderr.flush()
+    stdout.write(b'\n')
+    stdout.flush()
+    return result['exit_code']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET, help=f'Unix socket of the server (default: {DEFAULT_SOCKET})')
+    parser.add_argument('-P', '--port', type=int, default=None, help='Connect to localhost TCP PORT instead of the Unix socket')
+    parser.add_argument('-H', '--host', default='127.0.0.1', help='Address for --port (default: 127.0.0.1)')
+    parser.add_argument('--stats', action='store_true', default=False, help='Print the queue depth, latency percentiles and counters of the server as JSON')
+    args = parser.parse_args()
+
+    with connect(args.socket, args.host, args.port) as sock:
+        if args.stats:
+            sock.sendall(STATS_REQUEST)
+            sock.shutdown(socket.SHUT_WR)
+            print(json.dumps(json.loads(sock.makefile('rb').read()), indent=1))
+            raise SystemExit(0)
+        with open(0, 'rb') as stdin:
+            raise SystemExit(request(sock, stdin.read()))
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+# Print a packed binary solution file (`npuzzle.py --output`) as text
+
+import sys
+import json
+import argparse
+
+import npuzzle
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('file', help='Solution file written by npuzzle.py --output')
+    parser.add_argument('-i', '--info', action='store_true', default=False, help='Print the header as JSON instead of the moves')
+    args = parser.parse_args()
+
+    try:
+        size, n_moves, board_hash, chunks = npuzzle.SolutionFile.read(args.file)
+    except npuzzle.PuzzleError as err:
+        npuzzle.print_error(str(err))
+        raise SystemExit(err.exit_code)
+    if args.info:
+        print(json.dumps({'size': size, 'moves': n_moves, 'board_hash': board_hash.hex()}))
+        raise SystemExit(0)
+    for chunk in chunks:
+        sys.stdout.buffer.write(chunk)
+    sys.stdout.buffer.write(b'\n')
@@ -5,33 +5,59 @@ import argparse
 import random
 
 def make_puzzle(s, solvable, iterations):
-    def swap_empty(p):
-        idx = p.index(0)
+    ts = s*s
+    p = make_goal(s)
+    idx = p.index(0)
+    # 12 is divisible by 2, 3 and 4, the possible numbers of neighbours
+    for draw in random.choices(range(12), k=iterations):
         poss = []
         if idx % s > 0:
             poss.append(idx - 1)
         if idx % s < s - 1:
             poss.append(idx + 1)
-        if idx / s > 0 and idx - s >= 0:
+        if idx >= s:
             poss.append(idx - s)
-        if idx / s < s - 1:
+        if idx < ts - s:
             poss.append(idx + s)
-        swi = random.choice(poss)
+        swi = poss[draw % len(poss)]
         p[idx] = p[swi]
         p[swi] = 0
-
-    p = make_goal(s)
-    for _ in range(iterations):
-        swap_empty(p)
+        idx = swi
 
     if not solvable:
-        if p[0] == 0 or p[1] == 0:
-            p[-1], p[-2] = p[-2], p[-1]
-        else:
-            p[0], p[1] = p[1], p[0]
+        make_unsolvable(p)
+
+    return p
 
+def make_random_puzzle(s, solvable):
+    p = list(range(s*s))
+    random.shuffle(p)
+    if is_solvable(p, s) != solvable:
+        make_unsolvable(p) # swapping two tiles flips solvability either way
     return p
 
+def make_unsolvable(p):
+    if p[0] == 0 or p[1] == 0:
+        p[-1], p[-2] = p[-2], p[-1]
+    else:
+        p[0], p[1] = p[1], p[0]
+
+def is_solvable(p, s):
+    ts = s*s
+    # the empty tile counts as the last tile, so the goal is the identity
+    perm = [t - 1 if t else ts - 1 for t in p]
+    cycles = 0
+    seen = bytearray(ts)
+    for i in range(ts):
+        if seen[i]:
+            continue
+        cycles += 1
+        while not seen[i]:
+            seen[i] = 1
+            i = perm[i]
+    row, col = divmod(p.index(0), s)
+    return (ts - cycles + (s - row - 1) + (s - col - 1)) % 2 == 0
+
 def make_goal(s):
     ts = s*s
     # Reversed puzzle
@@ -41,6 +67,13 @@ def make_goal(s):
 
     return puzzle
 
+def print_puzzle(puzzle, s, solv):
+    w = len(str(s*s))
+    print("# This puzzle is %s" % ("solvable" if solv else "unsolvable"))
+    print("%d" % s)
+    for y in range(s):
+        print(' '.join(str(tile).rjust(w) for tile in puzzle[y*s:(y+1)*s]), end=' \n')
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
@@ -48,10 +81,13 @@ if __name__ == "__main__":
     parser.add_argument("-s", "--solvable", action="store_true", default=False, help="Forces generation of a solvable puzzle. Overrides -u.")
     parser.add_argument("-u", "--unsolvable", action="store_true", default=False, help="Forces generation of an unsolvable puzzle")
     parser.add_argument("-i", "--iterations", type=int, default=10000, help="Number of passes")
+    parser.add_argument("-r", "--random", action="store_true", default=False, help="Shuffle the tiles uniformly at random instead of doing passes, in O(size**2)")
+    parser.add_argument("-n", "--count", type=int, default=1, help="Number of puzzles, separated by '---' lines")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for reproducible puzzles")
 
     args = parser.parse_args()
 
-    random.seed()
+    random.seed(args.seed)
 
     if args.solvable and args.unsolvable:
         print("Can't be both solvable AND unsolvable, dummy !")
@@ -61,21 +97,21 @@ if __name__ == "__main__":
         print("Can't generate a puzzle with size lower than 2. It says so in the help. Dummy.")
         sys.exit(1)
 
-    if not args.solvable and not args.unsolvable:
-        solv = random.choice([True, False])
-    elif args.solvable:
-        solv = True
-    else:
-        solv = False
-
     s = args.size
 
-    puzzle = make_puzzle(s, solvable=solv, iterations=args.iterations)
+    for n in range(args.count):
+        if not args.solvable and not args.unsolvable:
+            solv = random.choice([True, False])
+        elif args.solvable:
+            solv = True
+        else:
+            solv = False
+
+        if args.random:
+            puzzle = make_random_puzzle(s, solvable=solv)
+        else:
+            puzzle = make_puzzle(s, solvable=solv, iterations=args.iterations)
 
-    w = len(str(s*s))
-    print("# This puzzle is %s" % ("solvable" if solv else "unsolvable"))
-    print("%d" % s)
-    for y in range(s):
-        for x in range(s):
-            print("%s" % (str(puzzle[x + y*s]).rjust(w)), end=' ')
-        print()
+        if n:
+            print("---")
+        print_puzzle(puzzle, s, solv)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Generate, solve and verify puzzles in one run, without text in between: every
+# stage is a worker process, boards and packed moves are passed in shared memory
+
+import os
+import sys
+import time
+import queue
+import random
+import argparse
+import traceback
+import multiprocessing
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from array import array
+
+import npuzzle
+
+generator = npuzzle.load_script('npuzzle_gen', 'npuzzle-gen.py')
+verifier = npuzzle.load_script('npuzzle_verify', 'npuzzle-verify.py')
+
+QUEUE_SIZE = 2 # puzzles waiting between two stages, each holding its shared memory
+POLL_INTERVAL = 0.5 # seconds between checks whether all stages are still alive
+
+class SharedMemoryWriter:
+    """Minimal binary file that writes into a shared memory block, for
+    MoveBuffer.write_packed().
+    """
+    __slots__ = ('buffer', 'offset')
+
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self.offset = 0
+
+    def write(self, data: bytes) -> None:
+        self.buffer[self.offset:self.offset + len(data)] = data
+        self.offset += len(data)
+
+def block_name(prefix: str, index: int, kind: str) -> str:
+    """Name of the shared memory block holding the board ('b') or the packed
+    moves ('m') of puzzle :index of the run :prefix. Fixed names let the parent
+    free every block after a stage failed, whichever stage held it.
+    """
+    return f'{prefix}_{index}{kind}'
+
+def unlink_block(name: str) -> None:
+    """Free the shared memory block :name, if it still exists.
+    """
+    try:
+        shm = SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+def run_stage(target, args: tuple, errors: multiprocessing.Queue) -> None:
+    """Run the stage :target with :args in this process. If it raises, report
+    the traceback on :errors and exit with a non-zero code.
+    """
+    try:
+        target(*args)
+    except BaseException:
+        errors.put(f'Stage {target.__name__} failed:\n{traceback.format_exc()}')
+        raise SystemExit(1)
+
+def generate(prefix: str, sizes: list[int], count: int, seed: int, iterations: int, output: multiprocessing.Queue) -> None:
+    """Stage 1: make :count solvable puzzles of every size in :sizes and pass
+    each on as the index of a shared memory block holding its flat board.
+    """
+    index = 0
+    for size in sizes:
+        for n in range(count):
+            random.seed(seed + size * count + n)
+            if iterations:
+                tiles = generator.make_puzzle(size, solvable=True, iterations=iterations)
+            else:
+                tiles = generator.make_random_puzzle(size, solvable=True)
+            board = array('I', tiles)
+            shm = SharedMemory(block_name(prefix, index, 'b'), create=True, size=len(board) * board.itemsize)
+            shm.buf[:len(board) * board.itemsize] = board.tobytes()
+            output.put((size, index))
+            shm.close() # the verify stage unlinks it
+            index += 1
+    output.put(None)
+
+def solve(prefix: str, optimize: bool, input: multiprocessing.Queue, output: multiprocessing.Queue) -> None:
+    """Stage 2: solve every board and pass on the moves, packed in another
+    shared memory block.
+    """
+    while (item := input.get()) is not None:
+        size, index = item
+        shm = SharedMemory(block_name(prefix, index, 'b'))
+        tiles = shm.buf[:4 * size * size].cast('I') # blocks may be rounded up to whole pages
+        puzzle = npuzzle.Puzzle.from_flat(size, tiles, optimize)
+        tiles.release()
+        shm.close()
+        start = time.perf_counter()
+        puzzle.solve()
+        elapsed_seconds = time.perf_counter() - start
+        moves = SharedMemory(block_name(prefix, index, 'm'), create=True, size=max((len(puzzle.moves) + 3) // 4, 1))
+        puzzle.moves.write_packed(SharedMemoryWriter(moves.buf))
+        output.put((size, index, len(puzzle.moves), elapsed_seconds))
+        moves.close()
+    output.put(None)
+
+def verify(prefix: str, input: multiprocessing.Queue, output: multiprocessing.Queue) -> None:
+    """Stage 3: verify the moves of every board, free both shared memory
+    blocks and pass on the result.
+    """
+    while (item := input.get()) is not None:
+        size, index, n_moves, solve_seconds = item
+        board, moves = SharedMemory(block_name(prefix, index, 'b')), SharedMemory(block_name(prefix, index, 'm'))
+        tiles = board.buf[:4 * size * size].cast('I')
+        puzzle = [list(tiles[row * size:(row + 1) * size]) for row in range(size)]
+        tiles.release()
+        start = time.perf_counter()
+        solution = npuzzle.MoveBuffer.from_packed(moves.buf, n_moves)
+        try:
+            ok = verifier.verify_puzzle(puzzle, (chunk.decode() for chunk in solution.chunks()), jobs=1)
+        except verifier.VerifyError: # illegal move
+            ok = False
+        verify_seconds = time.perf_counter() - start
+        del solution # views of moves.buf
+        for shm in (board, moves):
+            shm.close()
+            shm.unlink()
+        output.put((size, n_moves, solve_seconds, verify_seconds, ok))
+    output.put(None)
+
+def stop_pipeline(stages: list[multiprocessing.Process], prefix: str, n_puzzles: int) -> None:
+    """Terminate the remaining :stages after one of them failed and free the
+    shared memory blocks of the :n_puzzles puzzles of the run :prefix that
+    are still left.
+    """
+    for stage in stages:
+        stage.terminate()
+        stage.join()
+    for index in range(n_puzzles):
+        for kind in 'bm':
+            unlink_block(block_name(prefix, index, kind))
+
+def run_pipeline(sizes: list[int], count: int, seed: int, iterations: int, optimize: bool) -> bool:
+    """Run the three stages concurrently and print one line per puzzle, in
+    order. Return True if all solutions were verified. If a stage fails,
+    print its error, stop the others and return False.
+    """
+    resource_tracker.ensure_running() # shared by all stages, so blocks created in one and unlinked in another are tracked correctly
+    prefix = f'npuzzle{os.getpid()}'
+    boards, solutions, results, errors = (multiprocessing.Queue(QUEUE_SIZE) for _ in range(4))
+    stages = [
+        multiprocessing.Process(target=run_stage, args=(generate, (prefix, sizes, count, seed, iterations, boards), errors)),
+        multiprocessing.Process(target=run_stage, args=(solve, (prefix, optimize, boards, solutions), errors)),
+        multiprocessing.Process(target=run_stage, args=(verify, (prefix, solutions, results), errors)),
+    ]
+    for stage in stages:
+        stage.start()
+    all_ok = True
+    while True:
+        try:
+            result = results.get(timeout=POLL_INTERVAL)
+        except queue.Empty:
+            if all(stage.exitcode in (None, 0) for stage in stages):
+                continue
+            try:
+                npuzzle.print_error(errors.get(timeout=POLL_INTERVAL).rstrip())
+            except queue.Empty: # killed by a signal
+                npuzzle.print_error(f'A stage exited with code {next(stage.exitcode for stage in stages if stage.exitcode)}')
+            stop_pipeline(stages, prefix, len(sizes) * count)
+            return False
+        if result is None:
+            break
+        size, n_moves, solve_seconds, verify_seconds, ok = result
+        all_ok = all_ok and ok
+        print(f'Size: {size}, Time: {solve_seconds:.6f}s, Moves: {n_moves}, '
+              f'Verify Time: {verify_seconds:.6f}s, {"OK" if ok else "KO"}', file=sys.stderr, flush=True)
+    for stage in stages:
+        stage.join()
+    return all_ok and all(stage.exitcode == 0 for stage in stages)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sizes', type=int, nargs='*', default=[10, 50, 100], help='Puzzle sizes')
+    parser.add_argument('-n', '--count', type=int, default=1, help='Puzzles per size')
+    parser.add_argument('-s', '--seed', type=int, default=42, help='Base seed of the generated puzzles')
+    parser.add_argument('-i', '--iterations', type=int, default=10000, help='Generator passes, 0 for uniformly random puzzles')
+    parser.add_argument('-O', '--optimize', action='store_true', default=False, help='Solve with npuzzle.py --optimize')
+    args = parser.parse_args()
+    if any(size < 3 for size in args.sizes):
+        parser.error('Can\'t generate a puzzle with size lower than 3')
+
+    start = time.perf_counter()
+    ok = run_pipeline(args.sizes, args.count, args.seed, args.iterations, args.optimize)
+    print(f'Total Time: {time.perf_counter() - start:.6f}s', file=sys.stderr, flush=True)
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# Long-running solver daemon: keeps a pool of warm (JIT compiled, when run with
+# `pypy3.10 --jit vec=1`) worker processes and answers npuzzle-client.py
+
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import tempfile
+import collections
+import multiprocessing
+import concurrent.futures
+
+import npuzzle
+
+DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), 'npuzzle.sock')
+STATS_REQUEST = b'STATS\n' # request text asking for the server stats instead of a solve
+MAX_REQUEST_SIZE = 1 << 28 # bytes, the text of a ~5400x5400 board
+LATENCY_WINDOW = 1 << 12 # most recent latencies kept for the percentiles
+WARM_UP_SIZES = (3, 8, 16, 32)
+WARM_UP_TIMEOUT = 600 # seconds to wait for all workers to start and warm up
+
+def make_warm_up_board(size: int) -> list[int]:
+    """Return a solvable board of :size by walking the empty tile randomly away
+    from the goal, like `npuzzle-gen.py -s`.
+    Takes O(size**3).
+    """
+    puzzle = npuzzle.Puzzle.from_flat(size, [*range(1, size * size), 0])
+    rng = random.Random(size)
+    for _ in range(size ** 3):
+        moves = []
+        if puzzle.empty_row > 0: moves.append('u')
+        if puzzle.empty_row < size - 1: moves.append('d')
+        if puzzle.empty_col > 0: moves.append('l')
+        if puzzle.empty_col < size - 1: moves.append('r')
+        puzzle.move(rng.choice(moves))
+    return list(puzzle.puzzle)
+
+def warm_up() -> None:
+    """Initializer of every worker process: solve a few boards, so that the JIT
+    has compiled the hot paths before the first real request arrives.
+    """
+    for size in WARM_UP_SIZES:
+        npuzzle.Puzzle.from_flat(size, make_warm_up_board(size)).solve()
+
+class Stats:
+    """Counters of the server, reported for a STATS_REQUEST and on shutdown.
+    """
+    __slots__ = ('started', 'n_requests', 'n_failed', 'n_running', 'n_queued', 'latencies')
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.n_requests = 0
+        self.n_failed = 0
+        self.n_running = 0
+        self.n_queued = 0
+        self.latencies: collections.deque[float] = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def as_dict(self) -> dict:
+        """Return the counters and the p50/p90/p99 latency (in seconds, from
+        accepting a request until its last move was sent) of the most recent
+        requests.
+        """
+        latencies = sorted(self.latencies)
+        percentiles = {}
+        for percentile in (50, 90, 99):
+            # nearest rank
+            percentiles[f'p{percentile}'] = latencies[max(0, -(-len(latencies) * percentile // 100) - 1)] if latencies else None
+        return {
+            'uptime': time.monotonic() - self.started,
+            'requests': self.n_requests,
+            'failed': self.n_failed,
+            'running': self.n_running,
+            'queue_depth': self.n_queued,
+            'latency': percentiles,
+        }
+
+class Server:
+    """Accept puzzles in the input format of npuzzle.py, one per connection,
+    and solve them in a pool of :jobs worker processes, at most :max_jobs at
+    once. Requests beyond that wait in the queue.
+    A request is only read once it got its slot, so queued clients hold no
+    memory beyond the socket buffers.
+    The response is the moves followed by a newline, streamed in chunks and
+    only as fast as the client reads them, then one line of JSON with the
+    stats line npuzzle.py would have printed to standard error and its exit
+    code.
+    """
+    __slots__ = ('executor', 'jobs', 'optimize', 'cache_dir', 'cache_size', 'slots', 'stats')
+
+    def __init__(self, jobs: int, max_jobs: int, optimize: bool, cache_dir: str | None = None, cache_size: int | None = None):
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=warm_up)
+        self.jobs = jobs
+        self.optimize = optimize
+        self.cache_dir = cache_dir # see npuzzle.solve_batch_item()
+        self.cache_size = cache_size
+        self.slots = asyncio.Semaphore(max_jobs)
+        self.stats = Stats()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        start = time.monotonic()
+        try:
+            head = await self.read_head(reader)
+            if head == STATS_REQUEST:
+                writer.write(json.dumps(self.stats.as_dict()).encode() + b'\n')
+                await writer.drain()
+                return
+            self.stats.n_requests += 1
+            report, moves, exit_code = await self.solve(head, reader)
+            for chunk in moves.chunks():
+                writer.write(chunk)
+                await writer.drain()
+            writer.write(b'\n' + json.dumps({'report': report, 'exit_code': exit_code}).encode() + b'\n')
+            await writer.drain()
+            if exit_code:
+                self.stats.n_failed += 1
+            self.stats.latencies.append(time.monotonic() - start)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.stats.n_failed += 1
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    async def read_head(reader: asyncio.StreamReader) -> bytes:
+        """Read just enough to tell a STATS_REQUEST from a puzzle: at most
+        len(STATS_REQUEST) + 1 bytes.
+        """
+        head = b''
+        while len(head) <= len(STATS_REQUEST):
+            part = await reader.read(len(STATS_REQUEST) + 1 - len(head))
+            if not part:
+                break
+            head += part
+        return head
+
+    @staticmethod
+    async def read_request(reader: asyncio.StreamReader, head: bytes) -> bytes:
+        """Read the rest of the request after :head until the client shuts down
+        its side of the connection, but not more than MAX_REQUEST_SIZE + 1
+        bytes in total.
+        """
+        parts = [head]
+        n_bytes = len(head)
+        while n_bytes <= MAX_REQUEST_SIZE:
+            part = await reader.read(npuzzle.STREAM_BUFFER_SIZE)
+            if not part:
+                break
+            parts.append(part)
+            n_bytes += len(part)
+        return b''.join(parts)
+
+    async def solve(self, head: bytes, reader: asyncio.StreamReader) -> tuple[str, npuzzle.MoveBuffer, int]:
+        """Wait for a free job slot, then read the request starting with :head
+        and solve it in a worker process.
+        """
+        self.stats.n_queued += 1
+        async with self.slots:
+            self.stats.n_queued -= 1
+            self.stats.n_running += 1
+            try:
+                request = await self.read_request(reader, head)
+                if len(request) > MAX_REQUEST_SIZE:
+                    return npuzzle.format_error('Input too large') + '\n', npuzzle.MoveBuffer(), 1
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self.executor, npuzzle.solve_batch_item, request.decode(errors='replace'), self.optimize, self.cache_dir, self.cache_size)
+            finally:
+                self.stats.n_running -= 1
+
+    async def start_workers(self) -> None:
+        """Start all worker processes and wait until every one ran the warm_up()
+        initializer: :jobs tasks that block on a common barrier can only finish
+        once there are :jobs workers, with any start method.
+        """
+        loop = asyncio.get_running_loop()
+        with multiprocessing.Manager() as manager:
+            barrier = manager.Barrier(self.jobs)
+            await asyncio.gather(*(loop.run_in_executor(self.executor, barrier.wait, WARM_UP_TIMEOUT) for _ in range(self.jobs)))
+
+    async def serve(self, socket_path: str, host: str, port: int | None) -> None:
+        if port is None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path) # stale socket of a previous run
+            server = await asyncio.start_unix_server(self.handle, socket_path)
+            address = socket_path
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            address = f'{host}:{port}'
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await self.start_workers()
+        print(f'Listening on {address}', file=sys.stderr, flush=True)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if port is None and os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.executor.shutdown(cancel_futures=True)
+            print(json.dumps(self.stats.as_dict()), file=sys.stderr, flush=True)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-s', '--socket', default=DEFAULT_SOCKET, help=f'Unix socket to listen on (default: {DEFAULT_SOCKET})')
+    parser.add_argument('-P', '--port', type=int, default=None, help='Listen on localhost TCP PORT instead of the Unix socket')
+    parser.add_argument('-H', '--host', default='127.0.0.1', help='Address for --port (default: 127.0.0.1)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes (default: number of CPUs)')
+    parser.add_argument('-m', '--max-jobs', type=int, default=None, help='Number of puzzles solved at once, the rest is queued (default: --jobs)')
+    parser.add_argument('-O', '--optimize', action='store_true', default=False, help='Cancel inverse move pairs (ud, du, lr, rl) while solving')
+    parser.add_argument('-C', '--cache-dir', metavar='DIR', help='Look solutions up in and add them to the on-disk solution cache in DIR')
+    parser.add_argument('--cache-size', type=int, metavar='BYTES', help=f'Keep up to BYTES of packed solutions in the memory of every worker (default: {npuzzle.CACHE_SIZE} if --cache-dir is given)')
+    args = parser.parse_args()
+
+    jobs = args.jobs or os.cpu_count() or 1
+    server = Server(jobs, args.max_jobs or jobs, args.optimize, args.cache_dir, args.cache_size)
+    asyncio.run(server.serve(args.socket, args.host, args.port))
@@ -1,13 +1,45 @@
 #!/usr/bin/env python3
 
+import os
 import sys
-import copy
-from typing import TextIO
+import json
+import mmap
+import time
+import struct
+import hashlib
+import argparse
+import operator
+import itertools
+import collections
+import concurrent.futures
+from array import array
+from typing import TextIO, BinaryIO, Iterator, Iterable
 
-def exit_error(msg: str, exit_code: int) -> None:
+CHUNK_SIZE = 1 << 20 # moves per chunk, the unit of work of one worker
+MOVES = 'udlr'
+MOVE_DELTAS = {'u': (-1, 0), 'd': (1, 0), 'l': (0, -1), 'r': (0, 1)}
+# every move encoded as the signed byte delta of the empty tile's row or column
+ROW_STEPS = bytes.maketrans(b'udlr', b'\xff\x01\x00\x00')
+COL_STEPS = bytes.maketrans(b'udlr', b'\x00\x00\xff\x01')
+# packed binary solution files, see SolutionFile in npuzzle.py
+SOLUTION_MAGIC = b'NPZS'
+SOLUTION_VERSION = 1
+SOLUTION_HEADER = struct.Struct('<4sBIQQQ16s') # magic, version, size, moves, residual moves, runs, board hash
+SOLUTION_RUN = struct.Struct('<QBI') # residual moves before the run, move code, length
+DECODE = bytes.maketrans(b'\x00\x01\x02\x03', b'udlr')
+
+class VerifyError(Exception):
+    """Invalid input or illegal move. :exit_code is the exit status of the
+    command line interface for this error, :index the index of the illegal
+    move, if any.
+    """
+    def __init__(self, msg: str, exit_code: int, index: int | None = None):
+        super().__init__(msg)
+        self.exit_code = exit_code
+        self.index = index
+
+def print_error(msg: str) -> None:
     print(f'\033\x5b31m{msg}\033\x5bm', file=sys.stderr, flush=True)
-    if exit_code:
-        raise SystemExit(exit_code)
 
 def get_line_without_comments(file: TextIO) -> list[str]:
     lines = []
@@ -18,31 +50,131 @@ def get_line_without_comments(file: TextIO) -> list[str]:
             lines.append(line)
     return lines
 
-def parse_puzzle_and_solution(file: TextIO) -> tuple[list[list[int]], str]:
-    all_lines = get_line_without_comments(file)
-    if not all_lines:
-        exit_error('No input found', 1)
-    size, *lines = all_lines
-    *lines, solution_string = lines
+def iter_lines_without_comments(file: BinaryIO) -> Iterator[str]:
+    """Like get_line_without_comments(), but read :file line by line, so that
+    the rest of it stays unread.
+    """
+    for line in file:
+        line = line.split(b'#', 1)[0].strip()
+        if line:
+            yield line.decode()
+
+def parse_size(size: str) -> int:
     try:
         size = int(size)
     except ValueError:
-        exit_error('Can\'t convert size to int', 2)
+        raise VerifyError('Can\'t convert size to int', 2)
     if not size:
-        exit_error('Size can\'t be zero', 3)
+        raise VerifyError('Size can\'t be zero', 3)
+    return size
+
+def parse_rows(size: int, lines: list[str]) -> list[list[int]]:
     if len(lines) != size:
-        exit_error('Size of input unequals expected size', 4)
+        raise VerifyError('Size of input unequals expected size', 4)
     puzzle = []
     for line in lines:
         row = []
         try:
             row = [tile if (tile := int(n)) != 0 else 0 for n in line.split()]
         except ValueError:
-            exit_error('exit_error convert input to ints', 5)
+            raise VerifyError('exit_error convert input to ints', 5)
         if len(row) != size:
-            exit_error('Size of one row unequals expected size', 6)
+            raise VerifyError('Size of one row unequals expected size', 6)
         puzzle.append(row)
-    return puzzle, solution_string
+    return puzzle
+
+def parse_puzzle_and_solution(file: TextIO) -> tuple[list[list[int]], str]:
+    all_lines = get_line_without_comments(file)
+    if not all_lines:
+        raise VerifyError('No input found', 1)
+    size, *lines = all_lines
+    *lines, solution_string = lines
+    return parse_rows(parse_size(size), lines), solution_string
+
+def parse_puzzle(file: BinaryIO) -> list[list[int]]:
+    """Parse only the size and the rows of the puzzle from :file and leave the
+    solution unread (see iter_solution_chunks()).
+    """
+    lines = iter_lines_without_comments(file)
+    size = next(lines, None)
+    if size is None:
+        raise VerifyError('No input found', 1)
+    size = parse_size(size)
+    return parse_rows(size, list(itertools.islice(lines, size)))
+
+def iter_solution_chunks(file: BinaryIO) -> Iterator[str]:
+    """Yield the rest of :file in chunks of at most CHUNK_SIZE moves, with
+    comments and whitespace removed. All lines after the puzzle are treated as
+    one solution.
+    """
+    in_comment = False
+    while data := file.read(CHUNK_SIZE):
+        moves = []
+        while data:
+            if in_comment:
+                newline = data.find(b'\n')
+                if newline == -1:
+                    break
+                data = data[newline:]
+                in_comment = False
+            comment = data.find(b'#')
+            if comment == -1:
+                moves.append(data)
+                break
+            moves.append(data[:comment])
+            data = data[comment:]
+            in_comment = True
+        chunk = b''.join(moves).translate(None, b' \t\r\n\v\f')
+        if chunk:
+            yield chunk.decode('latin-1')
+
+def unpack_moves(packed: bytes) -> str:
+    """Return the moves of :packed, 4 per byte (2 bits each, lowest first).
+    """
+    n_bytes = len(packed)
+    value = int.from_bytes(packed, 'little')
+    mask = int.from_bytes(b'\x03' * n_bytes, 'little')
+    text = bytearray(4 * n_bytes)
+    for shift in range(4):
+        text[shift::4] = ((value >> (2 * shift)) & mask).to_bytes(n_bytes, 'little')
+    return text.translate(DECODE).decode()
+
+def read_binary_solution(path: str, puzzle: list[list[int]]) -> Iterator[str]:
+    """Memory-map the packed binary solution file :path and return an iterator
+    over its moves in chunks of at most CHUNK_SIZE moves.
+    Exit if the file is invalid or was written for another puzzle.
+    """
+    try:
+        with open(path, 'rb') as file:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError) as err:
+        raise VerifyError(f'Can\'t read solution file: {err}', 10)
+    if len(data) < SOLUTION_HEADER.size:
+        raise VerifyError('Invalid solution file', 10)
+    magic, version, size, n_moves, n_residual, n_runs, board_hash = SOLUTION_HEADER.unpack_from(data)
+    runs_start = SOLUTION_HEADER.size + (n_residual + 3) // 4
+    if magic != SOLUTION_MAGIC or version != SOLUTION_VERSION or len(data) != runs_start + n_runs * SOLUTION_RUN.size:
+        raise VerifyError('Invalid solution file', 10)
+    runs = list(SOLUTION_RUN.iter_unpack(memoryview(data)[runs_start:]))
+    if n_residual + sum(length for _, _, length in runs) != n_moves:
+        raise VerifyError('Invalid solution file', 10)
+    line = ' '.join(map(str, (len(puzzle), *itertools.chain.from_iterable(puzzle))))
+    if board_hash != hashlib.blake2b(line.encode(), digest_size=16).digest():
+        raise VerifyError('Solution file was written for another puzzle', 10)
+    return iter_binary_moves(memoryview(data)[SOLUTION_HEADER.size:runs_start], n_residual, runs)
+
+def iter_binary_moves(packed: memoryview, n_residual: int, runs: list[tuple[int, int, int]]) -> Iterator[str]:
+    """Yield the residual moves :packed with the :runs put back in, in chunks
+    of at most CHUNK_SIZE moves.
+    """
+    position = 0 # of the next residual move
+    for offset, code, length in runs + [(n_residual, 0, 0)]:
+        for start in range(position, offset, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, offset)
+            yield unpack_moves(packed[start // 4:(end + 3) // 4])[start % 4:start % 4 + end - start]
+        position = offset
+        for start in range(0, length, CHUNK_SIZE):
+            yield MOVES[code] * min(CHUNK_SIZE, length - start)
 
 def get_tile_pos(puzzle: list[list[int]], size: int, tile: int) -> tuple[int, int]:
     tile_idx = (-1, -1)
@@ -51,7 +183,7 @@ def get_tile_pos(puzzle: list[list[int]], size: int, tile: int) -> tuple[int, in
             if puzzle[r][c] == tile:
                 tile_idx = (r, c)
     if tile_idx == (-1, -1):
-        exit_error(f'Tile "{tile}" is missing.', 7)
+        raise VerifyError(f'Tile "{tile}" is missing.', 7)
     return tile_idx
 
 def print_puzzle(puzzle: list[list[int]], tile: int = -1) -> None:
@@ -69,31 +201,178 @@ def print_puzzle(puzzle: list[list[int]], tile: int = -1) -> None:
         print()
     print()
 
-def move(puzzle: list[list[int]], size: int, moves: str) -> None:
-    global original_puzzle
-    r, c = get_tile_pos(puzzle, size, 0)
+def first_out_of_bounds(steps: bytes, start: int, size: int) -> int:
+    """Return the index of the first of the :steps (signed byte deltas) after
+    which the path starting at :start leaves [0, size), or -1 if it never does.
+    The whole path is computed as a prefix sum at C speed.
+    """
+    if not steps:
+        return -1
+    path = list(itertools.accumulate(array('b', steps), initial=start))
+    if min(path) >= 0 and max(path) < size:
+        return -1
+    return next(i for i, pos in enumerate(path) if not 0 <= pos < size) - 1
+
+def find_illegal_move(moves: str, size: int, r: int, c: int) -> tuple | None:
+    """Return the first illegal move of :moves when the empty tile starts at
+    (:r, :c) as (index, move, r, c, error), or None if all moves are legal.
+    Unknown moves are checked with one translate() and the bounds of the
+    empty tile's whole path in bulk (see first_out_of_bounds()).
+    """
+    unknown = len(moves)
+    if moves.encode().translate(None, MOVES.encode()):
+        unknown = next(i for i, move in enumerate(moves) if move not in MOVE_DELTAS)
+    legal = moves[:unknown].encode()
+    out_of_bounds = [i for i in (first_out_of_bounds(legal.translate(ROW_STEPS), r, size),
+                                 first_out_of_bounds(legal.translate(COL_STEPS), c, size)) if i != -1]
+    first_illegal = min(out_of_bounds, default=unknown)
+    if first_illegal == len(moves):
+        return None
+    move = moves[first_illegal]
+    done = moves[:first_illegal]
+    r += done.count('d') - done.count('u')
+    c += done.count('r') - done.count('l')
+    if first_illegal == unknown:
+        error = None
+    elif move == 'u':
+        error = IndexError(f'negative index: {r-1}')
+    elif move == 'l':
+        error = IndexError(f'negative index: {c-1}')
+    else:
+        error = IndexError('list index out of range')
+    return first_illegal, move, r, c, error
+
+def apply_moves(flat: list[int], size: int, moves: str, r: int, c: int) -> None:
+    """Apply the legal :moves to the flat board :flat, the empty tile starting
+    at (:r, :c).
+    """
+    offsets = {'u': -size, 'd': size, 'l': -1, 'r': 1}
+    empty = r * size + c
+    empty_tile = flat[empty]
     for move in moves:
-        try:
-            if move == 'd':
-                puzzle[r][c], puzzle[r+1][c] = puzzle[r+1][c], puzzle[r][c]
-                r += 1
-            elif move == 'u':
-                if r-1 < 0: raise IndexError(f'negative index: {r-1}')
-                puzzle[r][c], puzzle[r-1][c] = puzzle[r-1][c], puzzle[r][c]
-                r -= 1
-            elif move == 'r':
-                puzzle[r][c], puzzle[r][c+1] = puzzle[r][c+1], puzzle[r][c]
-                c += 1
-            elif move == 'l':
-                if c-1 < 0: raise IndexError(f'negative index: {c-1}')
-                puzzle[r][c], puzzle[r][c-1] = puzzle[r][c-1], puzzle[r][c]
-                c -= 1
-            else:
-                exit_error(f'Unknown move "{move}".', 8)
+        target = empty + offsets[move]
+        flat[empty] = flat[target]
+        empty = target
+    flat[empty] = empty_tile
+
+def move_targets(size: int) -> dict[str, list[int]]:
+    """Return, for every move, the flat position the empty tile moves to from
+    every flat position, or -1 where the move would leave the board. The
+    tables are slices of one list, so they share their int objects.
+    Takes O(n**2).
+    """
+    n_tiles = size * size
+    positions = list(range(-size, n_tiles + size)) # position p at index p + size
+    targets = {}
+    for move, (row, col) in MOVE_DELTAS.items():
+        start = size + row * size + col
+        targets[move] = positions[start:start + n_tiles]
+    targets['u'][:size] = targets['d'][n_tiles - size:] = [-1] * size
+    targets['l'][::size] = targets['r'][size - 1::size] = [-1] * size
+    return targets
+
+def apply_checked_moves(flat: list[int], moves: str, empty: int, targets: dict[str, list[int]]) -> int:
+    """Like apply_moves(), but look the target of every move up in :targets
+    (see move_targets()), starting at the flat position :empty, which checks
+    it on the way. Return the flat position of the empty tile afterwards, or
+    -1 at the first illegal or unknown move, leaving :flat half moved.
+    """
+    empty_tile = flat[empty]
+    try:
+        for move in moves:
+            target = targets[move][empty]
+            if target < 0:
+                return -1
+            flat[empty] = flat[target]
+            empty = target
+    except KeyError:
+        return -1
+    flat[empty] = empty_tile
+    return empty
+
+def chunk_effect(moves: str, size: int, r: int, c: int) -> tuple[list[int], list[int], tuple | None]:
+    """Return the effect of :moves when the empty tile starts at (:r, :c) as
+    flat (destinations, sources): after the moves, the tile at destinations[i]
+    is the one that was at sources[i]. Instead, return the first illegal move
+    (see find_illegal_move()) if there is one.
+    Runs in a worker process, so it doesn't touch any global state.
+    """
+    error = find_illegal_move(moves, size, r, c)
+    if error is not None:
+        return [], [], error
+    n_tiles = size * size
+    positions = list(range(n_tiles))
+    apply_moves(positions, size, moves, r, c)
+    destinations = list(itertools.compress(range(n_tiles), map(operator.ne, positions, range(n_tiles))))
+    return destinations, [positions[destination] for destination in destinations], None
+
+def unflatten(flat: Iterable[int], size: int) -> list[list[int]]:
+    flat = list(flat)
+    return [flat[row * size:(row + 1) * size] for row in range(size)]
+
+def iter_chunks(chunks: Iterable[str], r: int, c: int) -> Iterator[tuple[int, str, int, int]]:
+    """Yield every chunk of moves with its offset and the position of the empty
+    tile before the chunk, assuming all previous chunks are legal.
+    """
+    offset = 0
+    for chunk in chunks:
+        yield offset, chunk, r, c
+        offset += len(chunk)
+        r += chunk.count('d') - chunk.count('u')
+        c += chunk.count('r') - chunk.count('l')
+
+def move(puzzle: list[list[int]], size: int, moves: str | Iterable[str], jobs: int | None = None) -> None:
+    """Apply :moves, a string or an iterable of chunks of moves, to :puzzle.
+    Long strings are split into chunks of CHUNK_SIZE moves. The effects of
+    the chunks (see chunk_effect()) are computed across a pool of :jobs
+    processes and then applied in order. With a single job, the chunks are
+    applied directly, checking every move on the way (see
+    apply_checked_moves()).
+    Raise VerifyError at the first illegal move, before :puzzle is changed.
+    """
+    r, c = get_tile_pos(puzzle, size, 0)
+    flat = [tile for row in puzzle for tile in row]
+    jobs = jobs or 1
+    chunks = moves
+    if isinstance(moves, str):
+        if len(moves) <= CHUNK_SIZE:
+            jobs = 1
+        chunks = (moves[offset:offset + CHUNK_SIZE] for offset in range(0, len(moves), CHUNK_SIZE))
 
-        except IndexError as err:
-            print_puzzle(original_puzzle)
-            exit_error(f'{move=}, {r=}, {c=}, {err=}\n', 9)
+    def apply(offset: int, result: tuple[list[int], list[int], tuple | None]) -> None:
+        destinations, sources, error = result
+        if error is not None:
+            index, move, r, c, err = error
+            index += offset
+            if err is None:
+                raise VerifyError(f'Unknown move "{move}" at {index=}.', 8, index)
+            raise VerifyError(f'{index=}, {move=}, {r=}, {c=}, {err=}\n', 9, index)
+        tiles = [flat[source] for source in sources]
+        for destination, tile in zip(destinations, tiles):
+            flat[destination] = tile
+
+    if jobs == 1:
+        targets = move_targets(size)
+        offset, empty = 0, r * size + c
+        for chunk in chunks:
+            end = apply_checked_moves(flat, chunk, empty, targets)
+            if end == -1: # find it again for the error
+                apply(offset, ([], [], find_illegal_move(chunk, size, *divmod(empty, size))))
+            offset, empty = offset + len(chunk), end
+    else:
+        pending: collections.deque = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            for offset, chunk, chunk_r, chunk_c in iter_chunks(chunks, r, c):
+                pending.append((offset, executor.submit(chunk_effect, chunk, size, chunk_r, chunk_c)))
+                if len(pending) >= 2 * jobs:
+                    offset, future = pending.popleft()
+                    apply(offset, future.result())
+            while pending:
+                offset, future = pending.popleft()
+                apply(offset, future.result())
+
+    for row in range(size):
+        puzzle[row][:] = flat[row * size:(row + 1) * size]
 
 def puzzle_solved(puzzle: list[list[int]], size: int) -> bool:
     expected_tile = 1
@@ -107,20 +386,119 @@ def puzzle_solved(puzzle: list[list[int]], size: int) -> bool:
             expected_tile += 1
     return True
 
-def verify_puzzle(puzzle: list[list[int]], solution_str: str) -> bool:
+def verify_puzzle(puzzle: list[list[int]], solution_str: str | Iterable[str], jobs: int | None = None) -> bool:
     size = len(puzzle)
-    move(puzzle, size, solution_str)
+    move(puzzle, size, solution_str, jobs)
     return puzzle_solved(puzzle, size)
 
+def read_manifest(path: str) -> Iterator[tuple[str, str | None]]:
+    """Yield the puzzle and solution file of every item of the batch :path,
+    which is either a manifest with one `PUZZLE [SOLUTION]` line per item
+    (paths relative to the manifest) or a directory. In a directory, every
+    file NAME is paired with NAME.sol or NAME.bin if one of them exists.
+    Without a solution file, the solution follows the puzzle in the same file.
+    """
+    if os.path.isdir(path):
+        names = set(os.listdir(path))
+        for name in sorted(names):
+            if name.endswith(('.sol', '.bin')) or not os.path.isfile(os.path.join(path, name)):
+                continue
+            solution = next((name + ext for ext in ('.sol', '.bin') if name + ext in names), None)
+            yield os.path.join(path, name), solution and os.path.join(path, solution)
+        return
+    directory = os.path.dirname(path)
+    with open(path) as file:
+        for line in file:
+            paths = line.split('#', 1)[0].split()
+            if paths:
+                yield os.path.join(directory, paths[0]), os.path.join(directory, paths[1]) if len(paths) > 1 else None
+
+def iter_solution_file(path: str, puzzle: list[list[int]]) -> Iterator[str]:
+    """Yield the moves of the solution file :path in chunks, which is either
+    text or in the packed binary format (see read_binary_solution()).
+    """
+    with open(path, 'rb') as file:
+        if file.read(len(SOLUTION_MAGIC)) == SOLUTION_MAGIC:
+            yield from read_binary_solution(path, puzzle)
+        else:
+            file.seek(0)
+            yield from iter_solution_chunks(file)
+
+def verify_item(puzzle_path: str, solution_path: str | None) -> dict:
+    """Verify one batch item in a worker process and return its result: OK or
+    KO, the index of the first illegal move and the error, if any, and the
+    time it took.
+    """
+    start = time.perf_counter()
+    result = {'puzzle': puzzle_path, 'solution': solution_path, 'status': 'KO', 'first_failing_move': None, 'error': None}
+    try:
+        with open(puzzle_path, 'rb') as file:
+            puzzle = parse_puzzle(file)
+            solution = iter_solution_chunks(file) if solution_path is None else iter_solution_file(solution_path, puzzle)
+            if verify_puzzle(puzzle, solution):
+                result['status'] = 'OK'
+    except VerifyError as err:
+        result['first_failing_move'] = err.index
+        result['error'] = str(err).strip()
+    except OSError as err:
+        result['error'] = str(err)
+    except (UnicodeDecodeError, ValueError) as err: # not a puzzle file, report it instead of failing the batch
+        result['error'] = f'{type(err).__name__}: {err}'
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+def verify_batch(path: str, jobs: int | None) -> int:
+    """Verify all items of the batch :path (see read_manifest()) across a pool
+    of :jobs worker processes and print their results as a JSON list, in input
+    order. At most 2 items per worker are in flight.
+    Return 0 if all of them are OK, 1 otherwise.
+    """
+    jobs = jobs or 1
+    results = []
+    pending: collections.deque[concurrent.futures.Future] = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for puzzle_path, solution_path in read_manifest(path):
+            pending.append(executor.submit(verify_item, puzzle_path, solution_path))
+            if len(pending) >= 2 * jobs:
+                results.append(pending.popleft().result())
+        while pending:
+            results.append(pending.popleft().result())
+    json.dump(results, sys.stdout, indent=1)
+    print()
+    return 0 if all(result['status'] == 'OK' for result in results) else 1
+
 if __name__ == "__main__":
-    global original_puzzle
-    puzzle, solution_string = parse_puzzle_and_solution(open(0))
-    original_puzzle = copy.deepcopy(puzzle)
-    if verify_puzzle(puzzle, solution_string):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of worker processes verifying chunks of the solution, or items with --batch')
+    parser.add_argument('-s', '--stream', action='store_true', default=False, help='Read the solution in chunks while verifying, using memory independent of its length. All lines after the puzzle are treated as one solution')
+    parser.add_argument('-b', '--binary', metavar='FILE', help='Read the solution from FILE in the packed binary format written by `npuzzle.py --output` instead, the puzzle still from stdin')
+    parser.add_argument('-B', '--batch', metavar='PATH', help='Verify every puzzle/solution pair of a manifest file or a directory (see read_manifest()) and print the results as JSON')
+    args = parser.parse_args()
+    if args.batch is not None:
+        raise SystemExit(verify_batch(args.batch, args.jobs))
+
+    try:
+        if args.binary is not None:
+            puzzle = parse_puzzle(open(0, 'rb'))
+            solution = read_binary_solution(args.binary, puzzle)
+        elif args.stream:
+            stdin = open(0, 'rb')
+            puzzle = parse_puzzle(stdin)
+            solution = iter_solution_chunks(stdin)
+        else:
+            puzzle, solution = parse_puzzle_and_solution(open(0))
+        original_puzzle = array('l', itertools.chain.from_iterable(puzzle)) # flat copy, one machine word per tile
+        solved = verify_puzzle(puzzle, solution, args.jobs)
+    except VerifyError as err:
+        if err.exit_code == 9:
+            print_puzzle(unflatten(original_puzzle, len(puzzle)))
+        print_error(str(err))
+        raise SystemExit(err.exit_code)
+    if solved:
         print('\033\x5b32mOK\033\x5bm')
     else:
         print('\033\x5b31mKO\033\x5bm')
         print('Input Puzzle')
-        print_puzzle(original_puzzle)
+        print_puzzle(unflatten(original_puzzle, len(puzzle)))
         print('Output Puzzle')
         print_puzzle(puzzle)
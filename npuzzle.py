@@ -1,54 +1,566 @@
 #!/usr/bin/env python3
 # Preferably use `pypy3.10 --jit vec=1`
 
+import os
+import io
+import re
 import sys
+import json
+import mmap
+import stat
+import math
+import struct
+import hashlib
+import itertools
+import importlib.util
+import argparse
+import tempfile
+import functools
+import collections
+import concurrent.futures
 import time
-import timeit
 import typing
+from array import array
+
+STREAM_BUFFER_SIZE = 1 << 16 # bytes buffered by --stream before writing to stdout
+BATCH_SEPARATOR = '---' # line separating puzzles in --batch input
+COMMENT = re.compile(rb'#[^\n]*')
+OPTIMAL_MAX_SIZE = 5 # --optimal falls back to the row by row solver for bigger puzzles
+OPTIMAL_NODE_LIMIT = 1 << 20 # nodes --optimal expands before falling back
+FINISHER_WIDTH = 4 # columns of the last 2 rows solved by a FinisherTable lookup
+TABLE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'npuzzle')
+PHASES = ('rows', 'last_2_rows_cols', 'finish', 'done') # see Puzzle.iter_steps()
+CHECKPOINT_INTERVAL = 10.0 # seconds between --checkpoint saves
+CACHE_SIZE = 1 << 28 # bytes of packed moves in the memory tier of the solution cache
+
+class MoveBuffer:
+    """Growable move log that packs each move (u, d, l, r) into 2 bits, 4 moves
+    per byte. Moves are collected in a small text tail first and packed in bulk.
+    If :optimize, inverse pairs (ud, du, lr, rl) cancel out as moves are
+    appended, treating the log as a stack.
+    Moves that were drained (see self.drain()) are no longer stored but still
+    counted by len().
+    """
+    __slots__ = ('packed', 'tail', 'tail_len', 'n_packed', 'n_drained', 'optimize', 'n_cancelled')
+
+    MOVES = 'udlr' # move code == index, so code ^ 1 is the inverse move
+    ENCODE = bytes.maketrans(b'udlr', b'\x00\x01\x02\x03')
+    DECODE = bytes.maketrans(b'\x00\x01\x02\x03', b'udlr')
+    TAIL_LIMIT = 1 << 16
+    CHUNK_SIZE = 1 << 18 # packed bytes decoded at once, i.e. 1MiB of text
+    INVERSES = {'u': 'd', 'd': 'u', 'l': 'r', 'r': 'l'}
+
+    def __init__(self, optimize: bool = False):
+        self.packed = bytearray()
+        self.tail: list[str] = []
+        self.tail_len = 0
+        self.n_packed = 0
+        self.n_drained = 0
+        self.optimize = optimize
+        self.n_cancelled = 0
+
+    def __len__(self) -> int:
+        return self.n_drained + self.n_packed + self.tail_len
+
+    def __iter__(self) -> typing.Iterator[str]:
+        for chunk in self.chunks():
+            yield from chunk.decode()
+
+    def extend(self, moves: str) -> None:
+        """Append every character of :moves (e.g. a whole macro like 'ldrul' * k).
+        Takes amortized O(moves).
+        """
+        if self.optimize:
+            self._extend_cancelling(moves)
+        else:
+            self.tail.append(moves)
+            self.tail_len += len(moves)
+        if self.tail_len >= self.TAIL_LIMIT:
+            self._pack_tail()
+
+    def _extend_cancelling(self, moves: str) -> None:
+        """Push every character of :moves onto the log, popping the last move
+        instead if the character is its inverse. Once the tail is used up, the
+        last packed byte is unpacked to continue cancelling.
+        Takes amortized O(moves).
+        """
+        stack = self.tail
+        inverses = self.INVERSES
+        n_cancelled = 0
+        for move in moves:
+            if not stack and self.n_packed:
+                self._make_writable()
+                stack.extend(self._unpack(self.packed[-1:]).decode())
+                del self.packed[-1]
+                self.n_packed -= 4
+            if stack and stack[-1] == inverses[move]:
+                stack.pop()
+                n_cancelled += 2
+            else:
+                stack.append(move)
+        self.tail_len = len(stack)
+        self.n_cancelled += n_cancelled
+
+    def _pack_tail(self) -> None:
+        """Pack all complete groups of 4 moves of the tail into self.packed and
+        keep the remaining (at most 3) moves in the tail.
+        Packing is done with big integer arithmetic: every code is < 4, so
+        c0 + c1 << 2 + c2 << 4 + c3 << 6 never carries into the next byte.
+        Takes O(tail).
+        """
+        text = ''.join(self.tail)
+        n_full = len(text) - len(text) % 4
+        self._make_writable()
+        self.packed += self._pack(text[:n_full])
+        self.n_packed += n_full
+        self.tail = list(text[n_full:])
+        self.tail_len = len(text) - n_full
+
+    @classmethod
+    def _pack(cls, text: str) -> bytes:
+        """Return the moves of :text packed 4 per byte. len(text) must be a
+        multiple of 4.
+        Takes O(text).
+        """
+        codes = text.encode().translate(cls.ENCODE)
+        n_bytes = len(codes) // 4
+        packed = 0
+        for shift in range(4):
+            packed += int.from_bytes(codes[shift::4], 'little') << (2 * shift)
+        return packed.to_bytes(n_bytes, 'little')
+
+    @classmethod
+    def _unpack(cls, packed: bytes) -> bytes:
+        """Return the moves of :packed as ASCII text, 4 characters per byte.
+        Takes O(packed).
+        """
+        n_bytes = len(packed)
+        value = int.from_bytes(packed, 'little')
+        mask = int.from_bytes(b'\x03' * n_bytes, 'little')
+        text = bytearray(4 * n_bytes)
+        for shift in range(4):
+            text[shift::4] = ((value >> (2 * shift)) & mask).to_bytes(n_bytes, 'little')
+        return bytes(text.translate(cls.DECODE))
+
+    def chunks(self) -> typing.Iterator[bytes]:
+        """Yield the moves as ASCII text in chunks of bounded size, so that the
+        whole solution never exists as text at once.
+        Takes O(moves).
+        """
+        packed = memoryview(self.packed)
+        for start in range(0, len(packed), self.CHUNK_SIZE):
+            yield self._unpack(packed[start:start + self.CHUNK_SIZE])
+        if self.tail_len:
+            yield ''.join(self.tail).encode()
+
+    def write(self, file: typing.BinaryIO) -> None:
+        """Write all moves as text to the binary :file.
+        Takes O(moves).
+        """
+        for chunk in self.chunks():
+            file.write(chunk)
+
+    def write_packed(self, file: typing.BinaryIO) -> None:
+        """Write all moves packed 4 per byte to the binary :file, the last byte
+        padded with 'u' moves. Drained moves are not included.
+        Takes O(moves).
+        """
+        file.write(self.packed)
+        tail = ''.join(self.tail)
+        file.write(self._pack(tail + 'u' * (-len(tail) % 4)))
+
+    @classmethod
+    def from_packed(cls, packed: bytes | mmap.mmap, n_moves: int) -> 'MoveBuffer':
+        """Return a buffer of the first :n_moves moves of :packed, as written by
+        self.write_packed(). :packed is not copied (an mmap stays mapped) until
+        the buffer is changed.
+        Takes O(1).
+        """
+        moves = cls()
+        n_full = n_moves // 4
+        moves.packed = memoryview(packed)[:n_full]
+        moves.n_packed = 4 * n_full
+        if n_moves % 4:
+            moves.tail = list(cls._unpack(packed[n_full:n_full + 1]).decode()[:n_moves % 4])
+            moves.tail_len = n_moves % 4
+        return moves
+
+    def __getstate__(self) -> tuple[None, dict]:
+        # views of self.from_packed() can't be pickled, e.g. for --batch results
+        state = {name: getattr(self, name) for name in self.__slots__}
+        if not isinstance(self.packed, bytearray):
+            state['packed'] = bytes(self.packed)
+        return None, state
+
+    def _make_writable(self) -> None:
+        """Copy self.packed if it is still the read-only view of self.from_packed().
+        """
+        if not isinstance(self.packed, bytearray):
+            self.packed = bytearray(self.packed)
+
+    def drain(self) -> typing.Iterator[bytes]:
+        """Yield the stored moves like self.chunks() and forget them afterwards.
+        Drained moves can't be cancelled anymore by later moves.
+        Takes O(moves).
+        """
+        yield from self.chunks()
+        self.n_drained += self.n_packed + self.tail_len
+        self.packed = bytearray()
+        self.tail = []
+        self.tail_len = 0
+        self.n_packed = 0
+
+class MoveCounter:
+    """Stand-in for MoveBuffer (see Puzzle.moves) that only counts the moves,
+    for --count-only. Nothing is stored, so memory stays at O(n**2).
+    """
+    __slots__ = ('n_moves', 'optimize', 'n_cancelled')
+
+    def __init__(self):
+        self.n_moves = 0
+        self.optimize = False # moves can't be cancelled without storing them
+        self.n_cancelled = 0
+
+    def __len__(self) -> int:
+        return self.n_moves
+
+    def extend(self, moves: str) -> None:
+        """Takes O(1)."""
+        self.n_moves += len(moves)
+
+class MoveDigest(MoveCounter):
+    """Stand-in for MoveBuffer (see Puzzle.moves) that counts the moves and
+    hashes them with BLAKE2b, for --digest. The digest equals `b2sum` of the
+    solution line without its newline. Like MoveBuffer, moves are collected in
+    a small text tail and hashed in bulk.
+    """
+    __slots__ = ('hash', 'tail', 'tail_len')
+
+    TAIL_LIMIT = MoveBuffer.TAIL_LIMIT
+
+    def __init__(self):
+        super().__init__()
+        self.hash = hashlib.blake2b()
+        self.tail: list[str] = []
+        self.tail_len = 0
+
+    def extend(self, moves: str) -> None:
+        """Takes amortized O(moves)."""
+        self.n_moves += len(moves)
+        self.tail.append(moves)
+        self.tail_len += len(moves)
+        if self.tail_len >= self.TAIL_LIMIT:
+            self._hash_tail()
+
+    def _hash_tail(self) -> None:
+        self.hash.update(''.join(self.tail).encode())
+        self.tail = []
+        self.tail_len = 0
+
+    def hexdigest(self) -> str:
+        self._hash_tail()
+        return self.hash.hexdigest()
+
+class PuzzleError(Exception):
+    """Invalid puzzle. :exit_code is the exit status of the command line
+    interface for this error.
+    """
+    def __init__(self, msg: str, exit_code: int):
+        super().__init__(msg)
+        self.exit_code = exit_code
+
+class UnsolvablePuzzleError(PuzzleError):
+    """The puzzle can't be turned back to the standard configuration."""
+    def __init__(self, msg: str = 'Puzzle not solvable'):
+        super().__init__(msg, 2)
+
+def format_error(msg: str) -> str:
+    return f'\033\x5b31m{msg}\033\x5bm'
+
+def print_error(msg: str) -> None:
+    print(format_error(msg), file=sys.stderr, flush=True)
+
+def load_script(name: str, filename: str):
+    """Import one of the hyphenated scripts next to this file (npuzzle-gen.py,
+    npuzzle-verify.py) as the module :name, independent of the working
+    directory.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+class FinisherTable:
+    """Optimal solutions of every solvable arrangement of a window of 2 rows
+    and :width columns, i.e. the last 2 rows of a puzzle once everything left
+    of the window is solved. The table holds, for the rank (see self.rank())
+    of every arrangement, the code of the first move of a shortest solution,
+    GOAL or UNREACHABLE. It is built once with a breadth first search from the
+    goal and memory-mapped from TABLE_DIR afterwards. Files with another
+    VERSION or a wrong checksum are built again.
+    """
+    __slots__ = ('width', 'n_cells', 'table', 'max_depth')
+
+    MAGIC = b'NPZF'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBBH16s') # MAGIC, VERSION, width, length of the longest solution, blake2b of the rest
+    GOAL = 4
+    UNREACHABLE = 255
+    CODES = {move: code for code, move in enumerate(MoveBuffer.MOVES)}
+
+    def __init__(self, width: int):
+        self.width = width
+        self.n_cells = 2 * width
+        path = os.path.join(TABLE_DIR, f'finisher-2x{width}.bin')
+        table = self._load(path)
+        if table is None:
+            table = self._build()
+            self._store(path, table)
+        self.table = table
+        self.max_depth = self.HEADER.unpack_from(table)[3]
+
+    def _load(self, path: str) -> mmap.mmap | None:
+        try:
+            with open(path, 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(data) != self.HEADER.size + math.factorial(self.n_cells):
+            return None # foreign or truncated file, build it again
+        magic, version, width, _, checksum = self.HEADER.unpack_from(data)
+        if (magic, version, width) != (self.MAGIC, self.VERSION, self.width) or \
+           checksum != hashlib.blake2b(memoryview(data)[self.HEADER.size:], digest_size=16).digest():
+            return None # older format or corrupted, build it again
+        return data
+
+    def _store(self, path: str, table: bytearray) -> None:
+        """Write :table to :path atomically. The table is only kept in memory
+        if TABLE_DIR is not writable.
+        """
+        try:
+            os.makedirs(TABLE_DIR, exist_ok=True)
+            file = tempfile.NamedTemporaryFile(dir=TABLE_DIR, prefix='.finisher.', delete=False)
+        except OSError:
+            return
+        try:
+            with file:
+                file.write(table)
+            os.replace(file.name, path)
+        except OSError:
+            os.unlink(file.name)
+
+    def rank(self, cells: list[int]) -> int:
+        """Return the index of the permutation :cells of range(self.n_cells)
+        in lexicographic order.
+        Takes O(width**2).
+        """
+        rank = 0
+        for i, cell in enumerate(cells):
+            rank = rank * (self.n_cells - i) + sum(1 for later in cells[i + 1:] if later < cell)
+        return rank
+
+    def neighbours(self, empty: int) -> typing.Iterator[tuple[int, str]]:
+        """Yield the cells the empty tile at :empty can swap with and the moves.
+        """
+        if empty >= self.width: yield empty - self.width, 'u'
+        if empty < self.width: yield empty + self.width, 'd'
+        if empty % self.width > 0: yield empty - 1, 'l'
+        if empty % self.width < self.width - 1: yield empty + 1, 'r'
+
+    def _build(self) -> bytearray:
+        """Return the table, with header, from a breadth first search over all
+        arrangements reachable from the goal, with cells holding the window
+        index + 1 of their tile's goal cell and 0 for the empty tile. For every
+        new arrangement, the first move of a shortest solution is the inverse
+        of the move that led to it.
+        Takes O((2 * width)! * width**2).
+        """
+        table = bytearray(self.HEADER.size) + bytearray([self.UNREACHABLE]) * math.factorial(self.n_cells)
+        goal = tuple(range(1, self.n_cells)) + (0,)
+        seen = {goal: self.GOAL}
+        queue = collections.deque([(goal, self.n_cells - 1, 0)])
+        depth = 0
+        while queue:
+            cells, empty, depth = queue.popleft()
+            for dest, move in self.neighbours(empty):
+                following = list(cells)
+                following[empty], following[dest] = following[dest], 0
+                following = tuple(following)
+                if following not in seen:
+                    seen[following] = self.CODES[MoveBuffer.INVERSES[move]]
+                    queue.append((following, dest, depth + 1))
+        for cells, code in seen.items():
+            table[self.HEADER.size + self.rank([cell - 1 if cell else self.n_cells - 1 for cell in cells])] = code
+        checksum = hashlib.blake2b(memoryview(table)[self.HEADER.size:], digest_size=16).digest()
+        self.HEADER.pack_into(table, 0, self.MAGIC, self.VERSION, self.width, depth, checksum)
+        return table
+
+    def solve(self, cells: list[int]) -> str:
+        """Return a shortest solution of the window :cells, which hold the
+        window index + 1 of their tile's goal cell and 0 for the empty tile.
+        The window must be solvable, i.e. part of a solvable puzzle. Raise
+        PuzzleError if the table doesn't lead to the goal within
+        self.max_depth moves.
+        Takes O(moves * width**2).
+        """
+        moves = []
+        empty = cells.index(0)
+        for _ in range(self.max_depth + 1):
+            code = self.table[self.HEADER.size + self.rank([cell - 1 if cell else self.n_cells - 1 for cell in cells])]
+            if code == self.GOAL:
+                return ''.join(moves)
+            move = MoveBuffer.MOVES[code] if code < len(MoveBuffer.MOVES) else None # UNREACHABLE
+            dest = next((dest for dest, legal in self.neighbours(empty) if legal == move), None)
+            if dest is None:
+                break
+            cells[empty], cells[dest] = cells[dest], 0
+            empty = dest
+            moves.append(move)
+        raise PuzzleError(f'Internal error: the 2x{self.width} finisher table doesn\'t solve the last 2 rows', 1)
+
+@functools.cache
+def get_finisher_table(width: int) -> FinisherTable:
+    """Return the FinisherTable for :width, loading or building it on first use.
+    """
+    return FinisherTable(width)
+
+@functools.cache
+def get_conflict_table(size: int) -> array:
+    """Return the linear conflicts of every line code of a puzzle of :size, for
+    Puzzle.solve_optimal(). A line code has one base size + 1 digit per cell
+    of a row or column: the index + 1 of the goal cell within the line of a
+    tile in its goal line, 0 for other tiles and the empty tile. Conflicts
+    count 2 moves for every tile that has to leave its goal line so that the
+    remaining ones can pass each other.
+    Takes O((size + 1)**size * size**2).
+    """
+    base = size + 1
+    table = array('B', bytes(base ** size))
+    for code in range(base ** size):
+        goals = []
+        rest = code
+        for _ in range(size):
+            rest, digit = divmod(rest, base)
+            if digit:
+                goals.append(digit)
+        longest = [1] * len(goals) # longest increasing subsequence ending at i
+        for i in range(len(goals)):
+            for j in range(i):
+                if goals[j] < goals[i] and longest[j] + 1 > longest[i]:
+                    longest[i] = longest[j] + 1
+        table[code] = 2 * (len(goals) - max(longest, default=0))
+    return table
 
 class Puzzle:
+    __slots__ = ('file', 'puzzle', 'is_solvable', 'size', 'tile_positions', 'empty', 'moves', 'move_offsets', 'macros', 'n_nodes', 'route_seen', 'route_stamp', 'route_queue', 'route_from')
+
+    MACRO_LIMIT = 32 # longer move strings are not compiled and cached
+
     def __init__(self,
-            file: typing.TextIO,
+            file: typing.TextIO | typing.BinaryIO,
+            optimize: bool = False,
         ):
-        """Initialize puzzle, determine solvability and find empty tile
-        Takes O(n**4) (self._is_solvable()).
+        """Parse the puzzle from :file and initialize it (see self._init_board()).
+        Raise PuzzleError if the input is invalid.
+        Takes O(n**2).
+        """
+        self.file = file
+        self._init_board(*self._parse_puzzle(), optimize)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, optimize: bool = False) -> 'Puzzle':
+        """Parse the puzzle from :data in the usual input format.
+        Takes O(n**2).
+        """
+        return cls(io.BytesIO(data), optimize)
+
+    @classmethod
+    def from_flat(cls, size: int, tiles: typing.Iterable[int], optimize: bool = False) -> 'Puzzle':
+        """Create the puzzle from its :tiles row by row, without any parsing.
+        Takes O(n**2).
+        """
+        puzzle = cls.__new__(cls)
+        puzzle.file = None
+        if size <= 0:
+            puzzle.error('Size can\'t be zero', 3)
+        try:
+            board = array('I', tiles)
+        except (TypeError, OverflowError):
+            puzzle.error('Error convert input to ints', 5)
+        if len(board) != size ** 2:
+            puzzle.error('Size of input unequals expected size', 4)
+        puzzle._init_board(size, board, optimize)
+        return puzzle
+
+    def _init_board(self, size: int, puzzle: array, optimize: bool) -> None:
+        """Initialize puzzle, determine solvability, index the tile positions
+        and find empty tile. If :optimize, inverse move pairs are cancelled
+        from the solution while solving (see MoveBuffer).
+        Takes O(n**2).
         """
-        self.puzzle: list[list[int]]
+        self.puzzle: array # flat, indexed by row * size + col
         self.is_solvable: bool
         self.size: int
-        self.empty_row: int
-        self.empty_col: int
-        self.moves: list[str]
+        self.tile_positions: array
+        self.empty: int # flat index of the empty tile
+        self.moves: MoveBuffer
+        self.move_offsets: dict[str, int] # flat offset of the tile the empty tile swaps with
+        self.macros: dict[str, tuple[tuple[int, ...], tuple[int, ...]]] # see self._compile_macro()
 
-        self.file = file
-        self.puzzle = self._parse_puzzle()
-        self.size = len(self.puzzle)
+        self.size, self.puzzle = size, puzzle
+        self.move_offsets = {'u': -self.size, 'd': self.size, 'l': -1, 'r': 1}
+        self.macros = {}
+        self.tile_positions = self._index_tile_positions()
         self.is_solvable = self._is_solvable()
-        empty_pos: tuple[int, int] = self._get_tile_pos(0)
-        self.empty_row = empty_pos[0]
-        self.empty_col = empty_pos[1]
-        self.moves = []
+        self.empty = self.tile_positions[0]
+        self.moves = MoveBuffer(optimize)
+        self.n_nodes = 0 # expanded by self.solve_optimal()
+        self.route_seen: array | None = None # BFS buffers of self.route_empty(), allocated on first use
+        self.route_stamp = 0
+        self.route_queue: array | None = None
+        self.route_from: bytearray | None = None
 
         # print('\033\x5b30;42mInitial puzzle:\033\x5bm')
         # self.print_puzzle()
 
-    def _get_line_without_comments(self) -> list[str]:
-        """Return list of lines with comments removed.
-        Takes at least O(n**2).
-        """
-        lines = []
-        raw_lines = self.file.read().strip().splitlines()
-        for line in raw_lines:
-            line = line.split('#', 1)[0].strip()
-            if line:
-                lines.append(line)
-        return lines
-
-    def _parse_puzzle(self) -> list[list[int]]:
-        """Return a 2-dimensional integer array with the same number of rows
-        as columns, representing the N-puzzle. One entry will be 0, representing
+    @property
+    def empty_row(self) -> int:
+        return self.empty // self.size
+
+    @property
+    def empty_col(self) -> int:
+        return self.empty % self.size
+
+    def _read_input(self) -> bytes:
+        """Return the whole input as bytes with comments removed. Regular files
+        are memory-mapped instead of read.
+        Takes O(n**2).
+        """
+        try:
+            fileno = self.file.fileno()
+            if stat.S_ISREG(os.fstat(fileno).st_mode) and os.fstat(fileno).st_size:
+                with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as data:
+                    return COMMENT.sub(b'', data)
+        except (AttributeError, OSError, ValueError):
+            pass
+        buffer = getattr(self.file, 'buffer', None)
+        data = buffer.read() if buffer is not None else self.file.read()
+        return COMMENT.sub(b'', data.encode() if isinstance(data, str) else data)
+
+    def _get_line_without_comments(self) -> list[bytes]:
+        """Return list of non-empty lines with comments removed.
+        Takes O(n**2).
+        """
+        return list(filter(None, map(bytes.strip, self._read_input().splitlines())))
+
+    def _parse_puzzle(self) -> tuple[int, array]:
+        """Return the size and a flat unsigned integer array of size**2 entries,
+        representing the N-puzzle row by row. One entry will be 0, representing
         the empty tile.
-        Takes at least O(n**2).
+        Rows are converted in bulk straight into the array.
+        Takes O(n**2).
         """
         all_lines = self._get_line_without_comments()
         if not all_lines:
@@ -62,56 +574,74 @@ class Puzzle:
             self.error('Size can\'t be zero', 3)
         if len(lines) != size:
             self.error('Size of input unequals expected size', 4)
-        puzzle = []
+        puzzle = array('I')
         for line in lines:
-            row = []
-            try:
-                row = [tile if (tile := int(n)) != 0 else 0 for n in line.split()]
-            except ValueError:
-                self.error('Error convert input to ints', 5)
+            row = line.split()
             if len(row) != size:
                 self.error('Size of one row unequals expected size', 6)
-            puzzle.append(row)
-        return puzzle
+            try:
+                puzzle.extend(map(int, row))
+            except (ValueError, OverflowError):
+                self.error('Error convert input to ints', 5)
+        return size, puzzle
 
     def _is_solvable(self) -> bool:
         """Determine if the puzzle can be turned back to the standard
         configuration just by doing swaps with the empty tile.
-        Takes (n**4). Can be improved to O(n**3 * log(n)).
-        """
-        flat_puzzle = []
-        for row in self.puzzle:
-            for c in row:
-                if c != 0:
-                    flat_puzzle.append(c)
-                else: # interpret the empty tile (0) as having the square value
-                      # this way, number of inversions is 0 for the solved state
-                    flat_puzzle.append(self.size ** 2)
-        empty_idx = flat_puzzle.index(self.size ** 2)
-        row = empty_idx // self.size
-        col = empty_idx % self.size
-
-        n_inversions = 0
-        for i in range(0, len(flat_puzzle)):
-            for j in range(i + 1, len(flat_puzzle)):
-                if flat_puzzle[i] > flat_puzzle[j]:
-                    n_inversions += 1
+        The parity of the number of inversions equals the parity of the
+        permutation, which is (number of tiles - number of cycles) % 2.
+        Requires self.tile_positions. The result is cached in self.is_solvable.
+        Takes O(n**2).
+        """
+        n_tiles = self.size ** 2
+        # interpret the empty tile (0) as having the square value
+        # this way, the permutation is the identity for the solved state
+        flat_puzzle = [tile - 1 if tile != 0 else n_tiles - 1 for tile in self.puzzle]
+        n_cycles = 0
+        visited = bytearray(n_tiles)
+        for i in range(n_tiles):
+            if visited[i]:
+                continue
+            n_cycles += 1
+            while not visited[i]:
+                visited[i] = 1
+                i = flat_puzzle[i]
+        row, col = divmod(self.tile_positions[0], self.size)
         manhatten_to_bottom_right = (self.size - row - 1) + (self.size - col - 1)
-        puzzle_parity = (manhatten_to_bottom_right + n_inversions) % 2
+        puzzle_parity = (manhatten_to_bottom_right + n_tiles - n_cycles) % 2
         return puzzle_parity == 0
 
-    def _get_tile_pos(self, tile: int) -> tuple[int, int]:
-        """Linearly search for a tile.
+    def is_solved(self) -> bool:
+        """Return True if the board is in the standard configuration. An empty
+        solution is correct for a board that already is.
+        Takes O(n**2).
+        """
+        n_tiles = self.size ** 2
+        return self.empty == n_tiles - 1 and all(map(int.__eq__, self.puzzle, range(1, n_tiles)))
+
+    def _index_tile_positions(self) -> array:
+        """Return the inverse of the puzzle: for every tile its flat position
+        (row * size + col). Exit with an error if the puzzle is not a
+        permutation of the tiles 0 to size**2 - 1.
         Takes O(n**2).
         """
-        tile_idx = (-1, -1)
-        for r in range(self.size):
-            for c in range(self.size):
-                if self.puzzle[r][c] == tile:
-                    tile_idx = (r, c)
-        if tile_idx == (-1, -1):
+        n_tiles = self.size ** 2
+        tile_positions = array('i', [-1]) * n_tiles
+        for position, tile in enumerate(self.puzzle):
+            if tile >= n_tiles:
+                self.error(f'Tile "{tile}" is out of range.', 8)
+            if tile_positions[tile] != -1:
+                self.error(f'Tile "{tile}" is duplicated.', 9)
+            tile_positions[tile] = position
+        return tile_positions
+
+    def _get_tile_pos(self, tile: int) -> tuple[int, int]:
+        """Look up a tile in the tile position index.
+        Takes O(1).
+        """
+        if not 0 <= tile < len(self.tile_positions):
             self.error(f'Tile "{tile}" is missing.', 7)
-        return tile_idx
+        return divmod(self.tile_positions[tile], self.size)
 
     def print_puzzle(self, tile: int = -1) -> None:
         """Print puzzle as a 2d square and color the empty square red.
@@ -121,8 +651,8 @@ class Puzzle:
         """
         # print('\033\x5bH\033\x5b2J\033\x5b3J')
         time.sleep(0.5)
-        for i, row in enumerate(self.puzzle):
-            for j, col in enumerate(row):
+        for i in range(self.size):
+            for j, col in enumerate(self.puzzle[i * self.size:(i + 1) * self.size]):
                 if col == tile:
                     print(end=f'\033\x5b30;43m{col: >4} \033\x5bm')
                 elif col == i * self.size + j + 1 and col < tile:
@@ -134,89 +664,339 @@ class Puzzle:
             print()
         print()
 
-    def error(self, msg: str, exit_code: int) -> None:
-        """Print error :msg to standard output and exit process with non-zero
-        :exit_code. If exit_code is 0, do not exit.
+    def error(self, msg: str, exit_code: int) -> typing.NoReturn:
+        """Raise PuzzleError with :msg and the command line :exit_code.
         """
-        print(f'\033\x5b31m{msg}\033\x5bm', file=sys.stderr, flush=True)
-        if exit_code:
-            raise SystemExit(exit_code)
+        raise PuzzleError(msg, exit_code)
 
     def move(self, moves: str) -> None:
         """Perform moves (swaps with the emtpy tile) sequentially, provided as each character of :moves.
+        Straight runs ('r' * k) are applied as one slice rotation and other
+        macros by their net effect (see self._apply_macro()).
+        Keeps self.tile_positions in sync with every swap.
         Takes O(moves).
         """
+        n_moves = len(moves)
+        if n_moves == 0:
+            return
+        elif n_moves == 1:
+            target = self.empty + self.move_offsets[moves]
+            tile = self.puzzle[target]
+            self.puzzle[self.empty] = tile
+            self.puzzle[target] = 0
+            self.tile_positions[tile] = self.empty
+            self.tile_positions[0] = target
+            self.empty = target
+        elif moves.count(moves[0]) == n_moves:
+            self._move_straight(self.move_offsets[moves[0]], n_moves)
+        elif n_moves <= self.MACRO_LIMIT:
+            self._apply_macro(moves, 1)
+        else:
+            self._move_sequentially(moves)
+        self.moves.extend(moves)
+
+    def move_repeatedly(self, moves: str, repetitions: int) -> None:
+        """Perform :moves :repetitions times, e.g. move_repeatedly('ldrul', k)
+        instead of move('ldrul' * k). The move log still gets every single move.
+        Takes O(moves * repetitions).
+        """
+        if repetitions <= 0:
+            return
+        self._apply_macro(moves, repetitions)
+        self.moves.extend(moves * repetitions)
+
+    def _move_sequentially(self, moves: str) -> None:
+        """Perform :moves one swap at a time, without logging them.
+        Takes O(moves).
+        """
+        puzzle = self.puzzle
+        tile_positions = self.tile_positions
+        move_offsets = self.move_offsets
+        empty = self.empty
+        for move in moves:
+            target = empty + move_offsets[move]
+            tile = puzzle[target]
+            puzzle[empty] = tile
+            tile_positions[tile] = empty
+            empty = target
+        puzzle[empty] = 0
+        tile_positions[0] = empty
+        self.empty = empty
+
+    def _move_straight(self, offset: int, n_moves: int) -> None:
+        """Move the empty tile :n_moves times in the direction of :offset
+        (without logging), which shifts a segment of a row or column by one
+        cell, done as a single slice assignment.
+        Takes O(n_moves).
+        """
+        puzzle = self.puzzle
+        tile_positions = self.tile_positions
+        start = self.empty
+        end = start + n_moves * offset
+        step = abs(offset)
+        low, high = min(start, end), max(start, end)
+        if offset > 0: # tiles move towards the start
+            puzzle[low:high:step] = puzzle[low + step:high + step:step]
+            updated = range(low, high, step)
+        else: # tiles move towards the end
+            puzzle[low + step:high + step:step] = puzzle[low:high:step]
+            updated = range(low + step, high + step, step)
+        for pos in updated:
+            tile_positions[puzzle[pos]] = pos
+        puzzle[end] = 0
+        tile_positions[0] = end
+        self.empty = end
+
+    def _compile_macro(self, moves: str) -> tuple[tuple[int, ...], tuple[int, ...]]:
+        """Return the net effect of :moves relative to the empty tile as
+        (destination offsets, source offsets): after the moves, the tile at
+        empty + destination[i] is the one that was at empty + source[i]. The
+        empty tile ends up at the destination whose source is 0.
+        Results are cached in self.macros.
+        Takes O(moves) the first time and O(1) afterwards.
+        """
+        if moves in self.macros:
+            return self.macros[moves]
+        cells: dict[int, int] = {} # offset -> source offset of its current tile
+        empty = 0
         for move in moves:
-            if move == 'd':
-                self.puzzle[self.empty_row][self.empty_col], self.puzzle[self.empty_row+1][self.empty_col] = self.puzzle[self.empty_row+1][self.empty_col], self.puzzle[self.empty_row][self.empty_col]
-                self.empty_row += 1
-            elif move == 'u':
-                self.puzzle[self.empty_row][self.empty_col], self.puzzle[self.empty_row-1][self.empty_col] = self.puzzle[self.empty_row-1][self.empty_col], self.puzzle[self.empty_row][self.empty_col]
-                self.empty_row -= 1
-            elif move == 'r':
-                self.puzzle[self.empty_row][self.empty_col], self.puzzle[self.empty_row][self.empty_col+1] = self.puzzle[self.empty_row][self.empty_col+1], self.puzzle[self.empty_row][self.empty_col]
-                self.empty_col += 1
-            elif move == 'l':
-                self.puzzle[self.empty_row][self.empty_col], self.puzzle[self.empty_row][self.empty_col-1] = self.puzzle[self.empty_row][self.empty_col-1], self.puzzle[self.empty_row][self.empty_col]
-                self.empty_col -= 1
-            self.moves.append(move)
-            # self.print_puzzle()
-
-    def focus_tile_top(self, tile_real_row_col: list[int]) -> None:
+            target = empty + self.move_offsets[move]
+            cells[empty] = cells.get(target, target)
+            cells[target] = 0
+            empty = target
+        net_effect = tuple(cells.keys()), tuple(cells.values())
+        if len(moves) <= self.MACRO_LIMIT:
+            self.macros[moves] = net_effect
+        return net_effect
+
+    def _apply_macro(self, moves: str, repetitions: int) -> None:
+        """Apply the net effect of :moves :repetitions times (without logging).
+        Takes O(moved cells * repetitions).
+        """
+        destinations, sources = self._compile_macro(moves)
+        puzzle = self.puzzle
+        tile_positions = self.tile_positions
+        empty = self.empty
+        for _ in range(repetitions):
+            tiles = [puzzle[empty + source] for source in sources]
+            for destination, tile in zip(destinations, tiles):
+                puzzle[empty + destination] = tile
+                tile_positions[tile] = empty + destination
+            empty = tile_positions[0]
+        self.empty = empty
+
+    def route_empty(self, target: int, tile: int, locked: int, side: str) -> bool:
+        """Move the empty tile along a shortest path to the flat index :target
+        that avoids the flat index :tile and all flat indices below :locked
+        (the solved tiles). The path with a single turn that moves along the
+        row first is taken if it is free, then the one that moves along the
+        column first. Otherwise a breadth first search inside the bounding box
+        of both ends, widened by one cell, finds a detour, which is only taken
+        if it is shorter than the fixed sequence of self.focus_tile_<:side>().
+        Return False without moving if there is no such path.
+        Takes O(path) or, for detours, O(bounding box).
+        """
+        if target < locked or target == tile:
+            return False
+        size = self.size
+        empty_row, empty_col = divmod(self.empty, size)
+        target_row, target_col = divmod(target, size)
+        # moving along the row first keeps the empty tile on its side of the
+        # tile until the last segment, the side the repositioning moves were
+        # chosen for (see self.move_horizontally_using_bottom())
+        corner = empty_row * size + target_col
+        if self._is_free_segment(self.empty, corner, tile, locked) and self._is_free_segment(corner, target, tile, locked):
+            self.move('r' * (target_col - empty_col) + 'l' * (empty_col - target_col))
+            self.move('d' * (target_row - empty_row) + 'u' * (empty_row - target_row))
+            return True
+        corner = target_row * size + empty_col
+        if self._is_free_segment(self.empty, corner, tile, locked) and self._is_free_segment(corner, target, tile, locked):
+            self.move('d' * (target_row - empty_row) + 'u' * (empty_row - target_row))
+            self.move('r' * (target_col - empty_col) + 'l' * (empty_col - target_col))
+            return True
+        tile_row, tile_col = divmod(tile, size)
+        max_moves = self._legacy_focus_length(side, tile_row, tile_col) - 1
+        # a detour is at least 2 moves longer than the Manhattan distance
+        if max_moves < abs(target_row - empty_row) + abs(target_col - empty_col) + 2:
+            return False
+        return self._route_empty_around(target, tile, locked, max_moves)
+
+    def _is_free_segment(self, start: int, end: int, tile: int, locked: int) -> bool:
+        """Return True if the straight segment between the flat indices :start
+        and :end (in the same row or column) contains neither :tile nor solved
+        tiles.
+        Takes O(1).
+        """
+        low, high = min(start, end), max(start, end)
+        if low < locked: # the solved tiles are a prefix of the flat indices
+            return False
+        if low // self.size == high // self.size: # same row
+            return not low <= tile <= high
+        return not (low <= tile <= high and tile % self.size == low % self.size)
+
+    def _route_empty_around(self, target: int, tile: int, locked: int, max_moves: int) -> bool:
+        """Breadth first search for self.route_empty(), from :target to the
+        empty tile, so that the path can be followed from the empty tile
+        without collecting it first. Cells are marked as seen with a per call
+        stamp, so the buffers never need to be cleared.
+        Return False without moving if there is no path of at most :max_moves.
+        """
+        size = self.size
+        if self.route_seen is None:
+            self.route_seen = array('I', bytes(4 * size * size))
+            self.route_queue = array('i', bytes(4 * size * size))
+            self.route_from = bytearray(size * size)
+        self.route_stamp += 1
+        stamp, seen, queue, next_move = self.route_stamp, self.route_seen, self.route_queue, self.route_from
+        empty = self.empty
+        empty_row, empty_col = divmod(empty, size)
+        target_row, target_col = divmod(target, size)
+        top, bottom = max(min(empty_row, target_row) - 1, 0), min(max(empty_row, target_row) + 1, size - 1)
+        left, right = max(min(empty_col, target_col) - 1, 0), min(max(empty_col, target_col) + 1, size - 1)
+        seen[target] = stamp
+        queue[0] = target
+        head, tail = 0, 1
+        while head < tail and seen[empty] != stamp:
+            pos = queue[head]
+            head += 1
+            row, col = divmod(pos, size)
+            # the move back to pos is the code of 'd', 'u', 'r' and 'l' from above, below, left and right
+            if row > top:
+                tail = self._route_visit(pos - size, 1, tile, locked, stamp, tail)
+            if row < bottom:
+                tail = self._route_visit(pos + size, 0, tile, locked, stamp, tail)
+            if col > left:
+                tail = self._route_visit(pos - 1, 3, tile, locked, stamp, tail)
+            if col < right:
+                tail = self._route_visit(pos + 1, 2, tile, locked, stamp, tail)
+        if seen[empty] != stamp:
+            return False
+        n_moves = 0
+        pos = empty
+        while pos != target:
+            pos += self.move_offsets[MoveBuffer.MOVES[next_move[pos]]]
+            n_moves += 1
+        if n_moves > max_moves:
+            return False
+        while empty != target: # straight runs at once
+            move = MoveBuffer.MOVES[next_move[empty]]
+            offset = self.move_offsets[move]
+            n_moves = 0
+            while empty != target and MoveBuffer.MOVES[next_move[empty]] == move:
+                empty += offset
+                n_moves += 1
+            self.move(move * n_moves)
+        return True
+
+    def _route_visit(self, pos: int, code: int, tile: int, locked: int, stamp: int, tail: int) -> int:
+        """Enqueue :pos for self._route_empty_around() unless it is blocked or
+        seen, with :code as the move towards the target. Return the new tail.
+        """
+        if pos < locked or pos == tile or self.route_seen[pos] == stamp:
+            return tail
+        self.route_seen[pos] = stamp
+        self.route_from[pos] = code
+        self.route_queue[tail] = pos
+        return tail + 1
+
+    def _legacy_focus_length(self, side: str, tile_row: int, tile_col: int) -> int:
+        """Return the number of moves self.focus_tile_<:side>() takes without
+        :locked, i.e. along its fixed sequence, for the tile at :tile_row,
+        :tile_col and the empty tile where it is now.
+        Takes O(1).
+        """
+        empty_row, empty_col = divmod(self.empty, self.size)
+        last = self.size - 1
+        n_moves = 0
+        if side == 'top':
+            if tile_row == last:
+                return abs(tile_row - 1 - empty_row) + abs(tile_col - empty_col)
+            side, n_moves = 'bottom', 1 # followed by 'u'
+        if side == 'bottom':
+            if empty_col == tile_col and empty_row < tile_row: # through the tile
+                return n_moves + tile_row - empty_row
+            return n_moves + abs(tile_row + 1 - empty_row) + abs(tile_col - empty_col)
+        while True:
+            if empty_col == tile_col and empty_row + 1 == tile_row: # 'rd' or 'ld'
+                n_moves += 2
+                empty_row, empty_col = tile_row, tile_col - 1 if empty_col == last else tile_col + 1
+            elif empty_row < last: # 'd'
+                n_moves += 1
+                empty_row += 1
+            if side == 'right':
+                break
+            if tile_col == last:
+                return n_moves + abs(tile_col - 1 - empty_col) + abs(tile_row - empty_row)
+            side, n_moves = 'right', n_moves + 1 # followed by 'l'
+        if empty_row == tile_row and empty_col < tile_col: # through the tile
+            return n_moves + tile_col - empty_col
+        return n_moves + abs(tile_col + 1 - empty_col) + abs(tile_row - empty_row)
+
+    def focus_tile_top(self, tile_real_row_col: list[int], locked: int | None = None) -> None:
         """Move the empty tile such that it is immediately above the target :tile,
         without affecting already solved tiles.
         This might move the target :tile if it is below a solved tile.
         Requires that the puzzle is solved top-to-bottom, left-to-right and
         requires at least 2 unsolved rows below the row where the tile is
         supposed to be inserted.
+        If :locked is given, route the empty tile along a shortest path that
+        avoids the tile and the flat indices below :locked instead (see
+        self.route_empty()), which never moves the tile.
         """
         tile_real_row, tile_real_col = tile_real_row_col
+        if locked is not None and tile_real_row > 0 and \
+           self.route_empty((tile_real_row - 1) * self.size + tile_real_col, tile_real_row * self.size + tile_real_col, locked, 'top'):
+            return
         if tile_real_row == self.size - 1:
-            while self.empty_row < tile_real_row - 1:
-                self.move('d')
-            while self.empty_row > tile_real_row - 1:
-                self.move('u')
-            while self.empty_col < tile_real_col:
-                self.move('r')
-            while self.empty_col > tile_real_col:
-                self.move('l')
+            self.move('d' * (tile_real_row - 1 - self.empty_row))
+            self.move('u' * (self.empty_row - (tile_real_row - 1)))
+            self.move('r' * (tile_real_col - self.empty_col))
+            self.move('l' * (self.empty_col - tile_real_col))
         else:
             self.focus_tile_bottom(tile_real_row_col)
             self.move('u')
             tile_real_row_col[0] += 1
 
-    def focus_tile_bottom(self, tile_real_row_col: list[int]) -> None:
+    def focus_tile_bottom(self, tile_real_row_col: list[int], locked: int | None = None) -> None:
         """Move the empty tile such that it is immediately below the target :tile,
         without affecting already solved tiles.
         This might move the target :tile if it is already at the bottom.
         Requires that the puzzle is solved top-to-bottom, left-to-right and
         requires at least 2 unsolved rows below the row where the tile is
         supposed to be inserted.
+        If :locked is given, route the empty tile along a shortest path that
+        avoids the tile and the flat indices below :locked instead (see
+        self.route_empty()), which never moves the tile.
         """
         tile_real_row, tile_real_col = tile_real_row_col
+        if locked is not None and tile_real_row < self.size - 1 and \
+           self.route_empty((tile_real_row + 1) * self.size + tile_real_col, tile_real_row * self.size + tile_real_col, locked, 'bottom'):
+            return
         if self.empty_col == tile_real_col and self.empty_row < tile_real_row:
             one_off = 0
             tile_real_row_col[0] -= 1
         else:
             one_off = 1
-        while self.empty_row < tile_real_row + one_off:
-            self.move('d')
-        while self.empty_row > tile_real_row + one_off:
-            self.move('u')
-        while self.empty_col < tile_real_col:
-            self.move('r')
-        while self.empty_col > tile_real_col:
-            self.move('l')
+        self.move('d' * (tile_real_row + one_off - self.empty_row))
+        self.move('u' * (self.empty_row - (tile_real_row + one_off)))
+        self.move('r' * (tile_real_col - self.empty_col))
+        self.move('l' * (self.empty_col - tile_real_col))
 
-    def focus_tile_left(self, tile_real_row_col: list[int]) -> None:
+    def focus_tile_left(self, tile_real_row_col: list[int], locked: int | None = None) -> None:
         """Move the empty tile such that it is immediately left to the target :tile,
         without affecting already solved tiles.
         This might move the target :tile if it is all the way to the left.
         Requires that the puzzle is solved top-to-bottom, left-to-right and
         requires at least 2 unsolved rows below the row where the tile is
         supposed to be inserted.
+        If :locked is given, route the empty tile along a shortest path that
+        avoids the tile and the flat indices below :locked instead (see
+        self.route_empty()), which never moves the tile.
         """
         tile_real_row, tile_real_col = tile_real_row_col
+        if locked is not None and tile_real_col > 0 and \
+           self.route_empty(tile_real_row * self.size + tile_real_col - 1, tile_real_row * self.size + tile_real_col, locked, 'left'):
+            return
 
         if self.empty_col == tile_real_col and self.empty_row + 1 == tile_real_row:
             if self.empty_col == self.size - 1:
@@ -227,28 +1007,30 @@ class Puzzle:
             self.move('d')
 
         if tile_real_col == self.size - 1:
-            while self.empty_col < tile_real_col - 1:
-                self.move('r')
-            while self.empty_col > tile_real_col - 1:
-                self.move('l')
-            while self.empty_row < tile_real_row:
-                self.move('d')
-            while self.empty_row > tile_real_row:
-                self.move('u')
+            self.move('r' * (tile_real_col - 1 - self.empty_col))
+            self.move('l' * (self.empty_col - (tile_real_col - 1)))
+            self.move('d' * (tile_real_row - self.empty_row))
+            self.move('u' * (self.empty_row - tile_real_row))
         else:
             self.focus_tile_right(tile_real_row_col)
             self.move('l')
             tile_real_row_col[1] += 1
 
-    def focus_tile_right(self, tile_real_row_col: list[int]) -> None:
+    def focus_tile_right(self, tile_real_row_col: list[int], locked: int | None = None) -> None:
         """Move the empty tile such that it is immediately right to the target :tile,
         without affecting already solved tiles.
         This might move the target :tile if it all the way to the right.
         Requires that the puzzle is solved top-to-bottom, left-to-right and
         requires at least 2 unsolved rows below the row where the tile is
         supposed to be inserted.
+        If :locked is given, route the empty tile along a shortest path that
+        avoids the tile and the flat indices below :locked instead (see
+        self.route_empty()), which never moves the tile.
         """
         tile_real_row, tile_real_col = tile_real_row_col
+        if locked is not None and tile_real_col < self.size - 1 and \
+           self.route_empty(tile_real_row * self.size + tile_real_col + 1, tile_real_row * self.size + tile_real_col, locked, 'right'):
+            return
 
         if self.empty_col == tile_real_col and self.empty_row + 1 == tile_real_row:
             if self.empty_col == self.size - 1:
@@ -263,14 +1045,10 @@ class Puzzle:
             tile_real_row_col[1] -= 1
         else:
             one_off = 1
-        while self.empty_col < tile_real_col + one_off:
-            self.move('r')
-        while self.empty_col > tile_real_col + one_off:
-            self.move('l')
-        while self.empty_row < tile_real_row:
-            self.move('d')
-        while self.empty_row > tile_real_row:
-            self.move('u')
+        self.move('r' * (tile_real_col + one_off - self.empty_col))
+        self.move('l' * (self.empty_col - (tile_real_col + one_off)))
+        self.move('d' * (tile_real_row - self.empty_row))
+        self.move('u' * (self.empty_row - tile_real_row))
 
     def move_horizontally_using_bottom(self, tile_real_row_col: list[int], tile_target_row_col: list[int]) -> bool:
         """Return True if the immediate top position of the tile to be moved
@@ -301,47 +1079,43 @@ class Puzzle:
             return False
         return True
 
-    def align_tile_horizontally(self, tile_real_row_col: list[int], tile_target_row_col: list[int], repositioning_moves: str) -> None:
+    def align_tile_horizontally(self, tile_real_row_col: list[int], tile_target_row_col: list[int], repositioning_moves: str, locked: int | None = None) -> None:
         """Move tile left or right until it reaches :tile_col.
+        :locked is passed on to the focus_tile_* methods.
         """
-        first = True
-        while tile_real_row_col[1] < tile_target_row_col[1]:
-            if first:
-                self.focus_tile_right(tile_real_row_col)
-                first = False
-            else:
-                self.move(repositioning_moves)
+        if tile_real_row_col[1] < tile_target_row_col[1]:
+            self.focus_tile_right(tile_real_row_col, locked)
             self.move('l')
-            tile_real_row_col[1] = tile_real_row_col[1] = tile_real_row_col[1] + 1
-        while tile_real_row_col[1] > tile_target_row_col[1]:
-            if first:
-                self.focus_tile_left(tile_real_row_col)
-                first = False
-            else:
-                self.move(repositioning_moves)
+            tile_real_row_col[1] += 1
+            repetitions = tile_target_row_col[1] - tile_real_row_col[1]
+            self.move_repeatedly(repositioning_moves + 'l', repetitions)
+            tile_real_row_col[1] += max(repetitions, 0)
+        elif tile_real_row_col[1] > tile_target_row_col[1]:
+            self.focus_tile_left(tile_real_row_col, locked)
             self.move('r')
-            tile_real_row_col[1] = tile_real_row_col[1] = tile_real_row_col[1] - 1
+            tile_real_row_col[1] -= 1
+            repetitions = tile_real_row_col[1] - tile_target_row_col[1]
+            self.move_repeatedly(repositioning_moves + 'r', repetitions)
+            tile_real_row_col[1] -= max(repetitions, 0)
 
-    def align_tile_vertically(self, tile_real_row_col: list[int], tile_target_row_col: list[int], repositioning_moves: str) -> None:
+    def align_tile_vertically(self, tile_real_row_col: list[int], tile_target_row_col: list[int], repositioning_moves: str, locked: int | None = None) -> None:
         """Move tile top or down until it reaches :tile_row.
+        :locked is passed on to the focus_tile_* methods.
         """
-        first = True
-        while tile_real_row_col[0] < tile_target_row_col[0]:
-            if first:
-                self.focus_tile_bottom(tile_real_row_col)
-                first = False
-            else:
-                self.move(repositioning_moves)
+        if tile_real_row_col[0] < tile_target_row_col[0]:
+            self.focus_tile_bottom(tile_real_row_col, locked)
             self.move('u')
-            tile_real_row_col[0] = tile_real_row_col[0] = tile_real_row_col[0] + 1
-        while tile_real_row_col[0] > tile_target_row_col[0]:
-            if first:
-                self.focus_tile_top(tile_real_row_col)
-                first = False
-            else:
-                self.move(repositioning_moves)
+            tile_real_row_col[0] += 1
+            repetitions = tile_target_row_col[0] - tile_real_row_col[0]
+            self.move_repeatedly(repositioning_moves + 'u', repetitions)
+            tile_real_row_col[0] += max(repetitions, 0)
+        elif tile_real_row_col[0] > tile_target_row_col[0]:
+            self.focus_tile_top(tile_real_row_col, locked)
             self.move('d')
-            tile_real_row_col[0] = tile_real_row_col[0] = tile_real_row_col[0] - 1
+            tile_real_row_col[0] -= 1
+            repetitions = tile_real_row_col[0] - tile_target_row_col[0]
+            self.move_repeatedly(repositioning_moves + 'd', repetitions)
+            tile_real_row_col[0] -= max(repetitions, 0)
 
     def get_horizontal_repositioning_moves(self, tile_real_row_col: list[int], tile_target_row_col: list[int]) -> str:
         """Return the needed repositioning moves after a tile has been moved
@@ -386,9 +1160,10 @@ class Puzzle:
             tile_real_row_col = list(self._get_tile_pos(tile))
 
             repositioning_moves_horizontal = self.get_horizontal_repositioning_moves(tile_real_row_col, tile_target_row_col)
-            self.align_tile_horizontally(tile_real_row_col, tile_target_row_col, repositioning_moves_horizontal)
+            # all tiles before this one are solved
+            self.align_tile_horizontally(tile_real_row_col, tile_target_row_col, repositioning_moves_horizontal, tile - 1)
             repositioning_moves_vertical = self.get_vertical_repositioning_moves(tile_real_row_col, tile_target_row_col)
-            self.align_tile_vertically(tile_real_row_col, tile_target_row_col, repositioning_moves_vertical)
+            self.align_tile_vertically(tile_real_row_col, tile_target_row_col, repositioning_moves_vertical, tile - 1)
 
     def solve_row_last_2_tiles(self, row: int) -> None:
         """Solve last 2 tiles of a particular :row.
@@ -489,7 +1264,7 @@ class Puzzle:
             self.align_tile_vertically(PR, PT, 'luur') # move P to LT
             # now L is either at 1. (LT[0]+2, LT[1]-1) or 2. (LT[0]+2, LT[1])
             self.move('d')
-            if self.puzzle[LT[0] + 2][LT[1]-1] == L: # if L is at (LT[0]+2, LT[1]-1)
+            if self.puzzle[(LT[0] + 2) * self.size + LT[1] - 1] == L: # if L is at (LT[0]+2, LT[1]-1)
                 self.move('lurd') # synchronize, now L will be at the same position that it would be if it was at 2. to begin with
             self.move('luurd') # solve the row
         else: # P is anywhere else, or the last column if L is not solved
@@ -543,7 +1318,7 @@ class Puzzle:
                 self.move('l' * (self.empty_col - TR[1]))
 
         # T as at bottom row, empty is right above, and T is not at BT (it must be moved)
-        self.move('ldrul' * (TR[1] - TT[1]))
+        self.move_repeatedly('ldrul', TR[1] - TT[1])
         # T is now at BT and empty is right above
 
     def last_2_rows_prepare_B(self, BR: list[int], BT: list[int]) -> None:
@@ -561,7 +1336,7 @@ class Puzzle:
             self.move('dru')
         else: # B is in bottom row?
             self.move('r' * (BR[1] - self.empty_col))
-        self.move('ldrul' * (BR[1] - BT[1] - 1))
+        self.move_repeatedly('ldrul', BR[1] - BT[1] - 1)
         self.move('rd')
 
     def solve_last_2_rows_col(self, col: int) -> None:
@@ -584,69 +1359,815 @@ class Puzzle:
 
         self.move('ulldr') # solve column
 
-    def solve_last_2_rows_n_minus_2_cols(self) -> None:
-        """Solve the first n-2 columns of the last 2 rows.
-        Requires that all previous rows are solved.
+    def finish_last_2_rows(self) -> None:
+        """Solve the last FINISHER_WIDTH (or fewer) columns of the last 2 rows
+        with a shortest sequence of moves looked up in a FinisherTable.
+        Requires that all tiles left of these columns are solved.
+        Takes O(1) once the table is loaded.
         """
-        for col in range(self.size - 2):
-            self.solve_last_2_rows_col(col)
-
-    def solve_last_4_tiles(self) -> None:
-        """Solve bottom right 4 tiles. If not self.is_solvable, then this step
-        will fail.
-        Requires that all tiles of the puzzle are solved, except these last 4.
-        """
-        UR = list(self._get_tile_pos(self.size ** 2 - 1)) # ultimate tile, the very last tile (biggest value)
-        if self.empty_row == UR[0] and \
-           self.empty_col == UR[1] - 1: # ultimate tile is in target position of empty
-            self.move('r')
-        elif self.empty_row == UR[0] + 1 and \
-             self.empty_col == UR[1]: # ultimate tile is above empty
-            self.move('urd')
-        elif self.empty_row == UR[0] + 1 and \
-             self.empty_col == UR[1] - 1: # ultimate tile is top-right (diagonally) of the empty tile
-            self.move('ruldr')
-        else: # already solved!
-            return
+        width = min(self.size, FINISHER_WIDTH)
+        first = self.size * (self.size - 2) + self.size - width # flat index of the top left window cell
+        cells = []
+        for pos in itertools.chain(range(first, first + width), range(first + self.size, first + self.size + width)):
+            tile = self.puzzle[pos]
+            if tile: # window index of the goal cell of the tile + 1
+                tile_row, tile_col = divmod(tile - 1, self.size)
+                tile = (tile_row - self.size + 2) * width + tile_col - self.size + width + 1
+            cells.append(tile)
+        self.move(get_finisher_table(width).solve(cells))
 
     def solve_last_2_rows(self) -> None:
         """Solve last two rows of the puzzle.
         Requires that all previous rows are solved.
         """
-        self.solve_last_2_rows_n_minus_2_cols()
-        self.solve_last_4_tiles()
+        if self.size < 2:
+            return
+        for col in range(self.size - min(self.size, FINISHER_WIDTH)):
+            self.solve_last_2_rows_col(col)
+        self.finish_last_2_rows()
 
-    def solve(self) -> None:
-        """Turn the puzzle back to its standard configuration and save the moves
-        in self.moves
+    def solve(self) -> MoveBuffer:
+        """Turn the puzzle back to its standard configuration, save the moves
+        in self.moves and return them.
         Takes probably at least O(n**3) multiplied by some big constant, or more.
-        Requires that the puzzle is solvable.
+        Raise UnsolvablePuzzleError if the puzzle is not solvable.
         """
-        if not puzzle._is_solvable():
-            puzzle.error('Puzzle not solvable', 0)
-            return
+        if not self.is_solvable:
+            raise UnsolvablePuzzleError()
         self.solve_n_minus_2_rows()
         self.solve_last_2_rows()
-        # Saves roughly 20% on 5x5, 10% on 10x10, and roughly 1% on 100x100.
-        # For 100x100, the time to solve would increase from 1.3 to 1.9 seconds.
-        # prev = ''
-        # moves = ''.join(self.moves)
-        # first = len(self.moves)
-        # while len(moves) != len(prev):
-        #     prev = moves
-        #     moves = moves.replace('rl', '').replace('lr', '').replace('ud', '').replace('du', '')
-        # self.moves = list(moves)
-        # print(f'Saving {first - len(self.moves)} moves (\033\x5b31m{100 - len(self.moves) / first * 100:.2f}%\033\x5bm)', file=sys.stderr)
+        return self.moves
+
+    def iter_steps(self, phase: int = 0, index: int = 0) -> typing.Iterator[tuple[int, int]]:
+        """Like self.solve(), but start at step :index of :phase (one of
+        PHASES) and yield the phase and index of the next step after every
+        solved row, every solved column of the last 2 rows and the finishing
+        columns, ending with PHASES.index('done').
+        Raise UnsolvablePuzzleError if the puzzle is not solvable.
+        """
+        if not self.is_solvable:
+            raise UnsolvablePuzzleError()
+        if PHASES[phase] == 'rows':
+            for row in range(index, self.size - 2):
+                self.solve_row_n_minus_2_tiles(row)
+                self.solve_row_last_2_tiles(row)
+                yield phase, row + 1
+            phase, index = phase + 1, 0
+        if self.size < 2:
+            return
+        if PHASES[phase] == 'last_2_rows_cols':
+            for col in range(index, self.size - min(self.size, FINISHER_WIDTH)):
+                self.solve_last_2_rows_col(col)
+                yield phase, col + 1
+            phase, index = phase + 1, 0
+        if PHASES[phase] == 'finish':
+            self.finish_last_2_rows()
+            yield phase + 1, 0
+
+    def iter_moves(self) -> typing.Iterator[bytes]:
+        """Like self.solve(), but yield the moves as ASCII text chunks after
+        every step of self.iter_steps(), so that self.moves only ever holds the
+        moves of one such step.
+        Raise UnsolvablePuzzleError if the puzzle is not solvable.
+        """
+        for _ in self.iter_steps():
+            yield from self.moves.drain()
+
+    def solve_optimal(self, max_nodes: int = OPTIMAL_NODE_LIMIT) -> bool:
+        """Turn the puzzle back to its standard configuration with as few moves
+        as possible, using IDA* with the Manhattan distance plus linear
+        conflicts as heuristic. Both are updated incrementally: a move only
+        changes the distance of one tile and the conflicts of two rows (for u,
+        d) or two columns (for l, r). The search moves tiles in place on a copy
+        of the board and moves them back when backtracking.
+        Return False without changing anything if more than :max_nodes nodes
+        were expanded, the number of which is saved in self.n_nodes.
+        Takes exponential time, only feasible for sizes up to OPTIMAL_MAX_SIZE.
+        Raise UnsolvablePuzzleError if the puzzle is not solvable.
+        """
+        if not self.is_solvable:
+            raise UnsolvablePuzzleError()
+        size = self.size
+        n_tiles = size * size
+        board = list(self.puzzle)
+        goal_row = [(tile - 1) // size for tile in range(n_tiles)]
+        goal_col = [(tile - 1) % size for tile in range(n_tiles)]
+        distances = [[0] * n_tiles] + [
+            [abs(pos // size - goal_row[tile]) + abs(pos % size - goal_col[tile]) for pos in range(n_tiles)]
+            for tile in range(1, n_tiles)
+        ]
+        # line codes (see get_conflict_table()) of all rows and columns, and
+        # the term a tile adds to the codes of its row and column at every cell
+        conflicts = get_conflict_table(size)
+        weights = [(size + 1) ** i for i in range(size)]
+        row_terms = [0] * n_tiles * n_tiles
+        col_terms = [0] * n_tiles * n_tiles
+        for tile in range(1, n_tiles):
+            for pos in range(n_tiles):
+                row, col = divmod(pos, size)
+                if goal_row[tile] == row:
+                    row_terms[tile * n_tiles + pos] = (goal_col[tile] + 1) * weights[col]
+                if goal_col[tile] == col:
+                    col_terms[tile * n_tiles + pos] = (goal_row[tile] + 1) * weights[row]
+        rows = [0] * size
+        cols = [0] * size
+        for pos, tile in enumerate(board):
+            rows[pos // size] += row_terms[tile * n_tiles + pos]
+            cols[pos % size] += col_terms[tile * n_tiles + pos]
+        neighbours = [
+            [(pos + offset, move) for move, offset in self.move_offsets.items()
+             if 0 <= pos + offset < n_tiles and (pos // size == (pos + offset) // size or offset in (-size, size))]
+            for pos in range(n_tiles)
+        ]
+        inverses = {**MoveBuffer.INVERSES, '': ''}
+        path: list[str] = []
+        n_nodes = 0
+        FOUND, LIMIT = -1, -2
+
+        def search(empty: int, g: int, h: int, bound: int, last: str) -> int:
+            """Depth first search below :empty, return FOUND, LIMIT or the
+            smallest f = g + h that exceeded :bound.
+            """
+            nonlocal n_nodes
+            if g + h > bound:
+                return g + h
+            if h == 0:
+                return FOUND
+            if n_nodes == max_nodes:
+                return LIMIT
+            n_nodes += 1
+            minimum = 1 << 30
+            for dest, move in neighbours[empty]:
+                if move == inverses[last]:
+                    continue
+                tile = board[dest]
+                board[empty], board[dest] = tile, 0 # make
+                # the tile keeps its order within a line it stays in, so the
+                # conflicts of that line don't change and cancel out below
+                row_a, row_b, col_a, col_b = empty // size, dest // size, empty % size, dest % size
+                to, of = tile * n_tiles + empty, tile * n_tiles + dest
+                dh = distances[tile][empty] - distances[tile][dest] \
+                    - conflicts[rows[row_a]] - conflicts[rows[row_b]] - conflicts[cols[col_a]] - conflicts[cols[col_b]]
+                rows[row_b] -= row_terms[of]
+                rows[row_a] += row_terms[to]
+                cols[col_b] -= col_terms[of]
+                cols[col_a] += col_terms[to]
+                dh += conflicts[rows[row_a]] + conflicts[rows[row_b]] + conflicts[cols[col_a]] + conflicts[cols[col_b]]
+                path.append(move)
+                result = search(dest, g + 1, h + dh, bound, move)
+                if result < 0:
+                    return result
+                path.pop()
+                rows[row_a] -= row_terms[to] # unmake
+                rows[row_b] += row_terms[of]
+                cols[col_a] -= col_terms[to]
+                cols[col_b] += col_terms[of]
+                board[empty], board[dest] = 0, tile
+                if result < minimum:
+                    minimum = result
+            return minimum
+
+        h = sum(distances[tile][pos] for pos, tile in enumerate(board)) + sum(conflicts[code] for code in rows + cols)
+        bound = h
+        while True:
+            result = search(self.empty, 0, h, bound, '')
+            if result == FOUND:
+                break
+            if result == LIMIT:
+                self.n_nodes = n_nodes
+                return False
+            bound = result
+        self.n_nodes = n_nodes
+        self.move(''.join(path))
+        return True
+
+class ProfiledPuzzle(Puzzle):
+    """Puzzle that records, for every phase of the solve and every row or
+    column, the elapsed time, the number of moves emitted and the number of
+    move()/move_repeatedly() and _get_tile_pos() calls. Plain Puzzle objects
+    don't pay anything for this.
+    """
+    __slots__ = ('profile', 'n_move_calls', 'n_get_tile_pos_calls', 'depth')
+
+    def __new__(cls, *args, **kwargs):
+        # set up here instead of __init__, which Puzzle.from_flat() doesn't call
+        self = super().__new__(cls)
+        self.profile: list[dict] = []
+        self.n_move_calls = 0
+        self.n_get_tile_pos_calls = 0
+        self.depth = 0 # nested phases (e.g. the recursion of solve_row_last_2_tiles) count towards the outer one
+        self.moves = MoveBuffer() # _record() needs it before _init_board() creates the real one
+        return self
+
+    def _record(self, phase: str, index: int | None, method: typing.Callable, *args):
+        """Call :method with :args and record its counters as :phase, :index.
+        """
+        if self.depth:
+            return method(*args)
+        self.depth += 1
+        n_moves, n_move_calls, n_get_tile_pos_calls = len(self.moves), self.n_move_calls, self.n_get_tile_pos_calls
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self.profile.append({
+                'phase': phase,
+                'index': index,
+                'seconds': time.perf_counter() - start,
+                'moves': len(self.moves) - n_moves,
+                'move_calls': self.n_move_calls - n_move_calls,
+                'get_tile_pos_calls': self.n_get_tile_pos_calls - n_get_tile_pos_calls,
+            })
+            self.depth -= 1
+
+    def summary(self) -> dict[str, dict]:
+        """Return the records of self.profile summed up per phase.
+        """
+        phases: dict[str, dict] = {}
+        for record in self.profile:
+            total = phases.setdefault(record['phase'], {'calls': 0, 'seconds': 0.0, 'moves': 0, 'move_calls': 0, 'get_tile_pos_calls': 0})
+            total['calls'] += 1
+            for key in ('seconds', 'moves', 'move_calls', 'get_tile_pos_calls'):
+                total[key] += record[key]
+        return phases
+
+    def write_profile(self, file: typing.TextIO) -> None:
+        json.dump({'size': self.size, 'phases': self.summary(), 'records': self.profile}, file, indent=1)
+        file.write('\n')
+
+    def move(self, moves: str) -> None:
+        self.n_move_calls += 1
+        super().move(moves)
+
+    def move_repeatedly(self, moves: str, repetitions: int) -> None:
+        self.n_move_calls += 1
+        super().move_repeatedly(moves, repetitions)
+
+    def _get_tile_pos(self, tile: int) -> tuple[int, int]:
+        self.n_get_tile_pos_calls += 1
+        return super()._get_tile_pos(tile)
+
+    def _parse_puzzle(self) -> tuple[int, array]:
+        return self._record('_parse_puzzle', None, super()._parse_puzzle)
+
+    def _is_solvable(self) -> bool:
+        return self._record('_is_solvable', None, super()._is_solvable)
+
+    def solve_row_n_minus_2_tiles(self, row: int) -> None:
+        self._record('solve_row_n_minus_2_tiles', row, super().solve_row_n_minus_2_tiles, row)
+
+    def solve_row_last_2_tiles(self, row: int) -> None:
+        self._record('solve_row_last_2_tiles', row, super().solve_row_last_2_tiles, row)
+
+    def solve_last_2_rows_col(self, col: int) -> None:
+        self._record('solve_last_2_rows_col', col, super().solve_last_2_rows_col, col)
+
+    def finish_last_2_rows(self) -> None:
+        self._record('finish_last_2_rows', None, super().finish_last_2_rows)
+
+class SolutionCache:
+    """Solutions by a hash of the parsed board, in an in-memory LRU tier of at
+    most :max_bytes packed moves and, if :directory is given, in an on-disk
+    tier of one file per board that is shared between processes and runs.
+    Files hold a header and the moves as written by MoveBuffer.write_packed().
+    They are written atomically (renamed into place) and memory-mapped when
+    read.
+    """
+    __slots__ = ('directory', 'max_bytes', 'entries', 'n_bytes', 'hits', 'misses')
+
+    MAGIC = b'NPZC'
+    HEADER = struct.Struct('<4sQ') # MAGIC, number of moves
+
+    def __init__(self, directory: str | None = None, max_bytes: int = CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: collections.OrderedDict[str, tuple[bytes, int]] = collections.OrderedDict() # key -> packed moves, number of moves
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as err:
+                print_error(f'Can\'t use cache directory: {err}, caching in memory only')
+                self.directory = None
+
+    @staticmethod
+    def key(puzzle: 'Puzzle') -> str:
+        """Return the cache key of the board of :puzzle, which must not have
+        been moved yet. Solutions with cancelled move pairs are cached apart.
+        Takes O(n**2).
+        """
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(b'%d %d ' % (puzzle.size, puzzle.moves.optimize))
+        digest.update(puzzle.puzzle.tobytes())
+        return digest.hexdigest()
+
+    def get(self, key: str) -> MoveBuffer | None:
+        """Return the cached moves of :key, or None. Files on disk are mapped,
+        not read, and added to the memory tier.
+        Takes O(moves) for hits on disk, O(1) in memory.
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return MoveBuffer.from_packed(*entry)
+        if self.directory is None:
+            return None
+        try:
+            with open(os.path.join(self.directory, key), 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        magic, n_moves = self.HEADER.unpack_from(data) if len(data) >= self.HEADER.size else (None, 0)
+        if magic != self.MAGIC or len(data) != self.HEADER.size + (n_moves + 3) // 4:
+            return None # foreign or truncated file, solve again and overwrite it
+        packed = memoryview(data)[self.HEADER.size:]
+        if self._remember(key, packed, n_moves):
+            return MoveBuffer.from_packed(*self.entries[key])
+        return MoveBuffer.from_packed(packed, n_moves)
+
+    def put(self, key: str, moves: MoveBuffer) -> None:
+        """Cache :moves, which must not have been drained, as the solution of
+        :key. Evict the least recently used entries until the memory tier fits
+        in self.max_bytes.
+        If the directory can't be written to, warn and cache in memory only
+        from then on.
+        Takes O(moves).
+        """
+        if self.directory is not None:
+            try:
+                self._write(key, moves)
+            except OSError as err:
+                print_error(f'Can\'t write to cache directory: {err}, caching in memory only')
+                self.directory = None
+        if (len(moves) + 3) // 4 > self.max_bytes:
+            return
+        buffer = io.BytesIO()
+        moves.write_packed(buffer)
+        self._remember(key, buffer.getbuffer(), len(moves))
+
+    def _write(self, key: str, moves: MoveBuffer) -> None:
+        """Write the file of :key in the on-disk tier atomically. On failure the
+        temporary file is removed and the error raised.
+        Takes O(moves).
+        """
+        file = tempfile.NamedTemporaryFile(dir=self.directory, prefix=f'.{key}.', delete=False)
+        try:
+            with file:
+                file.write(self.HEADER.pack(self.MAGIC, len(moves)))
+                moves.write_packed(file)
+            os.replace(file.name, os.path.join(self.directory, key))
+        except BaseException:
+            os.unlink(file.name)
+            raise
+
+    def _remember(self, key: str, packed: bytes | memoryview, n_moves: int) -> bool:
+        """Copy :packed into the memory tier as the entry of :key and evict the
+        least recently used entries until it fits in self.max_bytes.
+        Return False, without adding it, if it alone exceeds self.max_bytes.
+        """
+        if len(packed) > self.max_bytes:
+            return False
+        self.entries[key] = (bytes(packed), n_moves)
+        self.n_bytes += len(packed)
+        while self.n_bytes > self.max_bytes:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.n_bytes -= len(evicted)
+        return True
+
+    def solve(self, puzzle: 'Puzzle') -> MoveBuffer:
+        """Like puzzle.solve(), but look the solution up first and cache it
+        afterwards. On a hit the board is set to the standard configuration
+        without moving the tiles.
+        Raise UnsolvablePuzzleError if the puzzle is not solvable.
+        """
+        if not puzzle.is_solvable:
+            raise UnsolvablePuzzleError()
+        key = self.key(puzzle)
+        moves = self.get(key)
+        if moves is None:
+            self.misses += 1
+            moves = puzzle.solve()
+            self.put(key, moves)
+            return moves
+        self.hits += 1
+        # the goal board and its index directly, without puzzle._init_board()
+        n_tiles = puzzle.size ** 2
+        puzzle.puzzle = array('I', range(1, n_tiles))
+        puzzle.puzzle.append(0)
+        puzzle.tile_positions = array('i', range(-1, n_tiles - 1))
+        puzzle.tile_positions[0] = n_tiles - 1
+        puzzle.empty = n_tiles - 1
+        puzzle.moves = moves
+        return moves
+
+@functools.cache
+def get_cache(directory: str | None, max_bytes: int) -> SolutionCache:
+    """Return the SolutionCache of this process for :directory and :max_bytes,
+    so that batch and server workers keep theirs across puzzles.
+    """
+    return SolutionCache(directory, max_bytes)
+
+class SolutionFile:
+    """Packed binary solution format, written by `npuzzle.py --output` and read
+    by `npuzzle-verify.py --binary` and npuzzle-convert.py:
+    - HEADER: MAGIC, VERSION, size, number of moves, number of residual
+      moves, number of runs and board_hash() of the puzzle
+    - the residual moves, i.e. all moves except the runs, packed 4 per byte
+      like MoveBuffer.write_packed()
+    - the runs, straight runs of at least RUN_MIN moves cut out of the
+      solution, as RUN records: number of residual moves before the run, move
+      code (see MoveBuffer.MOVES), length
+    """
+    MAGIC = b'NPZS'
+    VERSION = 1
+    HEADER = struct.Struct('<4sBIQQQ16s')
+    RUN = struct.Struct('<QBI')
+    RUN_MIN = 64
+    RUNS = re.compile(rb'u{64,}|d{64,}|l{64,}|r{64,}') # at least RUN_MIN
+
+    @staticmethod
+    def board_hash(size: int, tiles: typing.Iterable[int]) -> bytes:
+        """Return the BLAKE2b hash (16 bytes) of the puzzle as a line of text:
+        the size and the tiles row by row, separated by single spaces.
+        """
+        return hashlib.blake2b(' '.join(map(str, (size, *tiles))).encode(), digest_size=16).digest()
+
+    @classmethod
+    def write(cls, path: str, size: int, tiles: typing.Iterable[int], moves: MoveBuffer) -> None:
+        """Write :moves, which must not have been drained, as the solution of
+        the puzzle :tiles to :path.
+        Takes O(moves).
+        """
+        runs = []
+        n_residual = 0
+        carry = b'' # residual moves that don't fill a byte yet
+        with open(path, 'wb') as file:
+            file.write(bytes(cls.HEADER.size))
+            for chunk in moves.chunks():
+                residual = [carry]
+                start = 0
+                for run in cls.RUNS.finditer(chunk):
+                    residual.append(chunk[start:run.start()])
+                    n_residual += run.start() - start
+                    runs.append(cls.RUN.pack(n_residual, MoveBuffer.MOVES.index(chr(chunk[run.start()])), run.end() - run.start()))
+                    start = run.end()
+                residual.append(chunk[start:])
+                n_residual += len(chunk) - start
+                residual = b''.join(residual)
+                n_full = len(residual) - len(residual) % 4
+                file.write(MoveBuffer._pack(residual[:n_full].decode()))
+                carry = residual[n_full:]
+            file.write(MoveBuffer._pack((carry + b'u' * (-len(carry) % 4)).decode()))
+            file.writelines(runs)
+            file.seek(0)
+            file.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, size, len(moves), n_residual, len(runs), cls.board_hash(size, tiles)))
+
+    @classmethod
+    def read(cls, path: str) -> tuple[int, int, bytes, typing.Iterator[bytes]]:
+        """Memory-map the solution file :path and return its size, number of
+        moves, board hash and an iterator over its moves as ASCII text chunks
+        of at most MoveBuffer.CHUNK_SIZE * 4 moves.
+        Raise PuzzleError if :path is not a valid solution file.
+        """
+        try:
+            with open(path, 'rb') as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as err:
+            raise PuzzleError(f'Can\'t read solution file: {err}', 1)
+        if len(data) < cls.HEADER.size:
+            raise PuzzleError('Invalid solution file', 1)
+        magic, version, size, n_moves, n_residual, n_runs, board_hash = cls.HEADER.unpack_from(data)
+        runs_start = cls.HEADER.size + (n_residual + 3) // 4
+        if magic != cls.MAGIC or version != cls.VERSION or len(data) != runs_start + n_runs * cls.RUN.size:
+            raise PuzzleError('Invalid solution file', 1)
+        runs = list(cls.RUN.iter_unpack(memoryview(data)[runs_start:]))
+        if n_residual + sum(length for _, _, length in runs) != n_moves:
+            raise PuzzleError('Invalid solution file', 1)
+        return size, n_moves, board_hash, cls._iter_moves(memoryview(data)[cls.HEADER.size:runs_start], n_residual, runs)
+
+    @classmethod
+    def _iter_moves(cls, packed: memoryview, n_residual: int, runs: list[tuple[int, int, int]]) -> typing.Iterator[bytes]:
+        chunk_size = 4 * MoveBuffer.CHUNK_SIZE
+        position = 0 # of the next residual move
+        for offset, code, length in runs + [(n_residual, 0, 0)]:
+            for start in range(position, offset, chunk_size):
+                end = min(start + chunk_size, offset)
+                text = MoveBuffer._unpack(packed[start // 4:(end + 3) // 4])
+                yield text[start % 4:start % 4 + end - start]
+            position = offset
+            for start in range(0, length, chunk_size):
+                yield MoveBuffer.MOVES[code].encode() * min(chunk_size, length - start)
+
+class Checkpoint:
+    """Periodic snapshots of a solve, taken between the steps of
+    Puzzle.iter_steps(), at most every :interval seconds. The moves are
+    appended, packed 4 per byte, to the log :path + '.moves', so a snapshot
+    only writes the moves since the previous one. The state file :path holds
+    a header, the board and the moves that are not packed yet (at most
+    MoveBuffer.TAIL_LIMIT). It is replaced atomically after the log was synced
+    and records how many bytes of the log are valid.
+    Requires that moves are neither cancelled nor drained.
+    """
+    __slots__ = ('path', 'interval', 'log', 'n_logged', 'last_saved')
+
+    MAGIC = b'NPZK'
+    HEADER = struct.Struct('<4sIBIQI') # MAGIC, size, phase, index, valid bytes of the log, unpacked moves
+
+    def __init__(self, path: str, interval: float = CHECKPOINT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.log: typing.BinaryIO | None = None
+        self.n_logged = 0
+        self.last_saved = time.monotonic()
+
+    def save(self, puzzle: 'Puzzle', phase: int, index: int, force: bool = False) -> None:
+        """Snapshot :puzzle before step :index of :phase, unless the previous
+        snapshot is less than self.interval seconds old and not :force.
+        Takes O(n**2 + moves since the previous snapshot).
+        """
+        if not force and time.monotonic() - self.last_saved < self.interval:
+            return
+        moves = puzzle.moves
+        if self.log is None:
+            self.log = open(self.path + '.moves', 'ab')
+            self.log.truncate(self.n_logged)
+        self.log.write(moves.packed[self.n_logged:])
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.n_logged = len(moves.packed)
+        tail = ''.join(moves.tail).encode()
+        file = tempfile.NamedTemporaryFile(dir=os.path.dirname(os.path.abspath(self.path)), prefix='.checkpoint.', delete=False)
+        try:
+            with file:
+                file.write(self.HEADER.pack(self.MAGIC, puzzle.size, phase, index, self.n_logged, len(tail)))
+                file.write(puzzle.puzzle.tobytes())
+                file.write(tail)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(file.name, self.path)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+        self.last_saved = time.monotonic()
+
+    def resume(self, puzzle_class: type['Puzzle'] | None = None) -> tuple['Puzzle', int, int]:
+        """Return the puzzle (a :puzzle_class) of the last snapshot with all moves
+        up to it, and the phase and index of the step to continue with.
+        Raise PuzzleError if there is no valid snapshot.
+        Takes O(n**2 + moves).
+        """
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+            with open(self.path + '.moves', 'rb') as file:
+                magic, size, phase, index, n_logged, n_tail = self.HEADER.unpack_from(data)
+                log = file.read(n_logged)
+        except (OSError, struct.error) as err:
+            raise PuzzleError(f'Can\'t resume from checkpoint: {err}', 1)
+        board = array('I')
+        if magic != self.MAGIC or phase >= len(PHASES) or len(log) != n_logged or \
+           len(data) != self.HEADER.size + size * size * board.itemsize + n_tail:
+            raise PuzzleError('Can\'t resume from checkpoint: invalid or truncated file', 1)
+        board.frombytes(data[self.HEADER.size:len(data) - n_tail])
+        puzzle = (puzzle_class or Puzzle).from_flat(size, board)
+        puzzle.moves = MoveBuffer.from_packed(log, 4 * n_logged)
+        puzzle.moves.extend(data[len(data) - n_tail:].decode())
+        self.n_logged = n_logged
+        return puzzle, phase, index
+
+    def remove(self) -> None:
+        """Delete the snapshot once the solve is complete.
+        """
+        if self.log is not None:
+            self.log.close()
+        for path in (self.path, self.path + '.moves'):
+            if os.path.exists(path):
+                os.unlink(path)
+
+def read_batch(path: str) -> typing.Iterator[str]:
+    """Yield the text of every puzzle of the batch input :path, which is either
+    '-' (standard input), a file or a directory (every file, sorted by name).
+    Puzzles in the same file are separated by a BATCH_SEPARATOR line.
+    """
+    if path == '-':
+        yield from split_batch(sys.stdin)
+    elif os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if os.path.isfile(os.path.join(path, name)):
+                with open(os.path.join(path, name)) as file:
+                    yield from split_batch(file)
+    else:
+        with open(path) as file:
+            yield from split_batch(file)
+
+def split_batch(file: typing.TextIO) -> typing.Iterator[str]:
+    """Yield the text of every puzzle in :file, reading it line by line.
+    """
+    lines: list[str] = []
+    for line in file:
+        if line.strip() == BATCH_SEPARATOR:
+            if lines:
+                yield ''.join(lines)
+            lines = []
+        else:
+            lines.append(line)
+    if any(line.split('#', 1)[0].strip() for line in lines):
+        yield ''.join(lines)
+
+def solve_batch_item(text: str, optimize: bool, cache_dir: str | None = None, cache_size: int | None = None) -> tuple[str, MoveBuffer, int]:
+    """Solve the puzzle :text in a worker process and return the messages and
+    stats line it would have printed to standard error, the moves and the exit
+    code the single puzzle mode would have used.
+    If :cache_dir or :cache_size is given, solutions are looked up in and added
+    to the SolutionCache of the worker.
+    """
+    try:
+        puzzle = Puzzle(io.StringIO(text), optimize=optimize)
+    except PuzzleError as err:
+        return format_error(str(err)) + '\n', MoveBuffer(), err.exit_code
+    cache = None
+    if cache_dir is not None or cache_size is not None:
+        cache = get_cache(cache_dir, CACHE_SIZE if cache_size is None else cache_size)
+        hits, misses = cache.hits, cache.misses
+    report = ''
+    exit_code = 0
+    start = time.perf_counter()
+    try:
+        if cache is not None:
+            cache.solve(puzzle)
+        else:
+            puzzle.solve()
+    except PuzzleError as err:
+        report = format_error(str(err)) + '\n'
+        exit_code = err.exit_code
+    elapsed_seconds = time.perf_counter() - start
+    report += f'Size: {puzzle.size}, Time: {elapsed_seconds:.6f}s, Moves: {len(puzzle.moves)}'
+    if cache is not None:
+        report += f', Cache hits: {cache.hits - hits}, Cache misses: {cache.misses - misses}'
+    report += '\n'
+    if exit_code:
+        return report, MoveBuffer(), exit_code # no partial solutions
+    elif not puzzle.is_solvable:
+        return report, puzzle.moves, 2
+    elif not puzzle.is_solved():
+        return report, puzzle.moves, 1
+    return report, puzzle.moves, 0
+
+def write_batch_result(result: tuple[str, MoveBuffer, int]) -> int:
+    """Print the standard error report and the moves of one solve_batch_item()
+    result and return its exit code.
+    """
+    report, moves, exit_code = result
+    sys.stderr.write(report)
+    sys.stderr.flush()
+    sys.stdout.flush()
+    moves.write(sys.stdout.buffer)
+    sys.stdout.buffer.write(b'\n')
+    sys.stdout.buffer.flush()
+    return exit_code
+
+def solve_batch(path: str, jobs: int | None, optimize: bool, cache_dir: str | None = None, cache_size: int | None = None) -> int:
+    """Solve all puzzles of :path across a pool of :jobs long-lived worker
+    processes. Print every solution to standard output and every stats line to
+    standard error, in input order. At most 2 puzzles per worker are in flight.
+    Return the highest exit code of all puzzles.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    exit_code = 0
+    pending: collections.deque[concurrent.futures.Future] = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        for text in read_batch(path):
+            pending.append(executor.submit(solve_batch_item, text, optimize, cache_dir, cache_size))
+            if len(pending) >= 2 * jobs:
+                exit_code = max(exit_code, write_batch_result(pending.popleft().result()))
+        while pending:
+            exit_code = max(exit_code, write_batch_result(pending.popleft().result()))
+    return exit_code
 
 if __name__ == '__main__':
-    puzzle = Puzzle(open(0))
-    elapsed_seconds = timeit.timeit('puzzle.solve()', globals=globals(), number=1)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-O', '--optimize', action='store_true', default=False, help='Cancel inverse move pairs (ud, du, lr, rl) while solving')
+    parser.add_argument('-S', '--stream', action='store_true', default=False, help='Write the moves to stdout while solving, row by row')
+    parser.add_argument('-b', '--batch', nargs='?', const='-', metavar='PATH', help=f'Solve many puzzles from a file, a directory or stdin (default), separated by "{BATCH_SEPARATOR}" lines. Prints one solution per line in input order')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Number of worker processes for --batch (default: number of CPUs)')
+    parser.add_argument('-p', '--profile', metavar='FILE', help='Write per phase and per row/column timings and counters as JSON to FILE (- for stderr). Not for --batch')
+    parser.add_argument('-C', '--cache-dir', metavar='DIR', help='Look solutions up in and add them to the on-disk solution cache in DIR')
+    parser.add_argument('--cache-size', type=int, metavar='BYTES', help=f'Keep up to BYTES of packed solutions in memory (default: {CACHE_SIZE}). Useful for --batch')
+    parser.add_argument('--optimal', action='store_true', default=False, help=f'Search a shortest solution with IDA* for sizes up to {OPTIMAL_MAX_SIZE}, falling back to the row by row solver after --node-limit nodes. Not for --batch, --stream and the solution cache')
+    parser.add_argument('--node-limit', type=int, default=OPTIMAL_NODE_LIMIT, help=f'Nodes --optimal expands at most (default: {OPTIMAL_NODE_LIMIT})')
+    parser.add_argument('--count-only', action='store_true', default=False, help='Only count the moves instead of storing them and print the count. Not for --batch, --stream, --optimize and the solution cache')
+    parser.add_argument('--digest', action='store_true', default=False, help='Only hash the moves (BLAKE2b, like b2sum of the solution line) instead of storing them and print the digest. Same restrictions as --count-only')
+    parser.add_argument('-c', '--checkpoint', metavar='FILE', help='Save the state of the solve to FILE and FILE.moves between rows and columns, at most every --checkpoint-interval seconds. Not for --batch, --stream, --optimize, --optimal, --count-only, --digest and the solution cache')
+    parser.add_argument('--checkpoint-interval', type=float, default=CHECKPOINT_INTERVAL, metavar='SECONDS', help=f'Seconds between checkpoints (default: {CHECKPOINT_INTERVAL:g})')
+    parser.add_argument('-r', '--resume', action='store_true', default=False, help='Continue the solve saved in --checkpoint FILE instead of reading a puzzle')
+    parser.add_argument('-o', '--output', metavar='FILE', help='Write the solution to FILE in the packed binary format (see SolutionFile) instead of printing it. Not for --batch, --stream, --count-only, --digest and --resume')
+    args = parser.parse_args()
+    if args.output is not None and (args.batch is not None or args.stream or args.count_only or args.digest or args.resume):
+        parser.error('--output can\'t be used with --batch, --stream, --count-only, --digest or --resume')
+    if args.profile is not None and args.batch is not None:
+        parser.error('--profile can\'t be used with --batch')
+    if args.resume and args.checkpoint is None:
+        parser.error('--resume requires --checkpoint')
+    if args.checkpoint is not None and (args.batch is not None or args.stream or args.optimize or args.optimal or args.count_only or args.digest or args.cache_dir is not None or args.cache_size is not None):
+        parser.error('--checkpoint can\'t be used with --batch, --stream, --optimize, --optimal, --count-only, --digest or the solution cache')
+    if (args.count_only or args.digest) and (args.batch is not None or args.stream or args.optimize or args.cache_dir is not None or args.cache_size is not None):
+        parser.error('--count-only and --digest can\'t be used with --batch, --stream, --optimize or the solution cache')
+    if args.count_only and args.digest:
+        parser.error('--count-only and --digest are mutually exclusive')
+    if args.optimal and (args.batch is not None or args.stream or args.cache_dir is not None or args.cache_size is not None):
+        parser.error('--optimal can\'t be used with --batch, --stream or the solution cache')
+    if args.stream and (args.cache_dir is not None or args.cache_size is not None):
+        parser.error('the solution cache can\'t be used with --stream')
 
-    print(f'Size: {puzzle.size}, Time: {elapsed_seconds:.6f}s, Moves: {len(puzzle.moves)}', file=sys.stderr, flush=True)
-    print(''.join(puzzle.moves))
+    if args.batch is not None:
+        raise SystemExit(solve_batch(args.batch, args.jobs, args.optimize, args.cache_dir, args.cache_size))
 
-    if len(puzzle.moves) == 0 and puzzle.is_solvable:
-        raise SystemExit(1)
+    checkpoint = None
+    phase, index = 0, 0
+    try:
+        if args.checkpoint is not None:
+            checkpoint = Checkpoint(args.checkpoint, args.checkpoint_interval)
+        if args.resume:
+            puzzle, phase, index = checkpoint.resume(ProfiledPuzzle if args.profile else Puzzle)
+        else:
+            puzzle = (ProfiledPuzzle if args.profile else Puzzle)(open(0), optimize=args.optimize)
+    except PuzzleError as err:
+        print_error(str(err))
+        raise SystemExit(err.exit_code)
+    if args.count_only:
+        puzzle.moves = MoveCounter()
+    elif args.digest:
+        puzzle.moves = MoveDigest()
+    tiles = array('I', puzzle.puzzle) if args.output is not None else None # the board is solved in place
+    cache = None
+    if args.cache_dir is not None or args.cache_size is not None:
+        cache = SolutionCache(args.cache_dir, CACHE_SIZE if args.cache_size is None else args.cache_size)
+
+    start = time.perf_counter()
+    search_seconds = None
+    exit_code = 0
+    try:
+        if args.stream:
+            with open(sys.stdout.fileno(), 'wb', buffering=STREAM_BUFFER_SIZE, closefd=False) as stdout:
+                try:
+                    for chunk in puzzle.iter_moves():
+                        stdout.write(chunk)
+                finally:
+                    stdout.write(b'\n')
+        elif args.optimal and puzzle.size <= OPTIMAL_MAX_SIZE:
+            if not puzzle.solve_optimal(args.node_limit):
+                print(f'Node limit of {args.node_limit} reached, solving row by row', file=sys.stderr, flush=True)
+                search_seconds = time.perf_counter() - start
+                puzzle.solve()
+        elif cache is not None:
+            cache.solve(puzzle)
+        elif checkpoint is not None:
+            for phase, index in puzzle.iter_steps(phase, index):
+                if PHASES[phase] != 'done':
+                    checkpoint.save(puzzle, phase, index)
+            checkpoint.remove()
+        else:
+            puzzle.solve()
+    except PuzzleError as err:
+        print_error(str(err))
+        exit_code = err.exit_code
+    elapsed_seconds = time.perf_counter() - start
+
+    stats = f'Size: {puzzle.size}, Time: {elapsed_seconds:.6f}s, Moves: {len(puzzle.moves)}'
+    if cache is not None:
+        stats += f', Cache hits: {cache.hits}, Cache misses: {cache.misses}'
+    if puzzle.n_nodes:
+        stats += f', Nodes: {puzzle.n_nodes}, Nodes/s: {puzzle.n_nodes / (search_seconds or elapsed_seconds):.0f}'
+    print(stats, file=sys.stderr, flush=True)
+    if args.optimize and puzzle.moves.n_cancelled:
+        n_moves = len(puzzle.moves) + puzzle.moves.n_cancelled
+        print(f'Saving {puzzle.moves.n_cancelled} moves (\033\x5b31m{puzzle.moves.n_cancelled / n_moves * 100:.2f}%\033\x5bm)', file=sys.stderr, flush=True)
+    if args.profile == '-':
+        puzzle.write_profile(sys.stderr)
+    elif args.profile:
+        with open(args.profile, 'w') as file:
+            puzzle.write_profile(file)
+    if exit_code:
+        if not args.stream:
+            print(flush=True) # no partial solutions
+    elif args.output is not None:
+        SolutionFile.write(args.output, puzzle.size, tiles, puzzle.moves)
+    elif args.count_only:
+        print(len(puzzle.moves), flush=True)
+    elif args.digest:
+        print(puzzle.moves.hexdigest(), flush=True)
+    elif not args.stream:
+        sys.stdout.flush()
+        puzzle.moves.write(sys.stdout.buffer)
+        sys.stdout.buffer.write(b'\n')
+        sys.stdout.buffer.flush()
+
+    if exit_code:
+        raise SystemExit(exit_code)
     elif not puzzle.is_solvable:
         raise SystemExit(2)
+    elif not puzzle.is_solved():
+        raise SystemExit(1)
     raise SystemExit(0)